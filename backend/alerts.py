@@ -0,0 +1,383 @@
+import json
+import logging
+import operator
+import os
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("visao_envx.alerts")
+
+# Operadores aceitos nas regras
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+# Returned by BaseRule.evaluate when a result has nothing the rule can evaluate
+NOT_APPLICABLE = object()
+
+
+def _compile_path(field: str):
+    """Compile a dotted field path ("a.b.0") into a tuple of keys"""
+    return tuple(int(part) if part.isdigit() else part for part in field.split("."))
+
+
+def _extract(results: dict, path) -> Optional[float]:
+    """Follow a compiled path inside a results dict, returning a number or None"""
+    value: Any = results
+    for key in path:
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+class BaseRule:
+    """Base class for all alert rules
+
+    Rules are edge-triggered: an alert is emitted when the condition becomes
+    true for a source, and re-armed once the condition becomes false again.
+    """
+
+    def __init__(self, name: str, analysis_type: Optional[str] = None,
+                 severity: str = "warning", message: Optional[str] = None):
+        self.name = name
+        self.analysis_type = analysis_type
+        self.severity = severity
+        self.message = message
+
+    def applies_to(self, analysis_type: str) -> bool:
+        return self.analysis_type is None or self.analysis_type == analysis_type
+
+    def new_state(self) -> dict:
+        """Create the per-source state for this rule"""
+        return {"active": False}
+
+    def evaluate(self, state: dict, results: dict, timestamp: float):
+        """Update state with a new result
+
+        Returns the observed value if triggered, None if not triggered, or
+        NOT_APPLICABLE when the result lacks the data the rule needs.
+        """
+        raise NotImplementedError("Subclasses must implement evaluate()")
+
+
+class ThresholdRule(BaseRule):
+    """Triggers when a numeric field crosses a fixed threshold"""
+
+    def __init__(self, name: str, field: str, op: str, value: float, **kwargs):
+        super().__init__(name, **kwargs)
+        self.field = field
+        self.path = _compile_path(field)
+        self.op = OPERATORS[op]
+        self.op_symbol = op
+        self.value = float(value)
+
+    def evaluate(self, state, results, timestamp):
+        observed = _extract(results, self.path)
+        if observed is None:
+            return NOT_APPLICABLE
+        return observed if self.op(observed, self.value) else None
+
+
+class RateOfChangeRule(BaseRule):
+    """Triggers when a field changes faster than a threshold over a sliding window
+
+    The rate is expressed in units per second between the oldest and newest
+    sample of the window.
+    """
+
+    def __init__(self, name: str, field: str, op: str, value: float, window: int = 5, **kwargs):
+        super().__init__(name, **kwargs)
+        if window < 2:
+            raise ValueError("window must be at least 2 samples")
+        self.field = field
+        self.path = _compile_path(field)
+        self.op = OPERATORS[op]
+        self.op_symbol = op
+        self.value = float(value)
+        self.window = int(window)
+
+    def new_state(self):
+        return {"active": False, "samples": deque(maxlen=self.window)}
+
+    def evaluate(self, state, results, timestamp):
+        observed = _extract(results, self.path)
+        if observed is None:
+            return NOT_APPLICABLE
+        samples = state["samples"]
+        samples.append((timestamp, observed))
+        if len(samples) < 2:
+            return None
+        (t0, v0), (t1, v1) = samples[0], samples[-1]
+        elapsed = t1 - t0
+        if elapsed <= 0:
+            return None
+        rate = (v1 - v0) / elapsed
+        return rate if self.op(rate, self.value) else None
+
+
+class ClassCountRule(BaseRule):
+    """Triggers on the number of detections of given classes
+
+    With ``window`` > 1 the count is summed over the last N results, kept as a
+    running total so each update is constant time.
+    """
+
+    def __init__(self, name: str, classes: List[str], op: str = ">=", value: float = 1,
+                 min_confidence: float = 0.0, window: int = 1, **kwargs):
+        kwargs.setdefault("analysis_type", "object_detection")
+        super().__init__(name, **kwargs)
+        self.classes = frozenset(classes)
+        self.op = OPERATORS[op]
+        self.op_symbol = op
+        self.value = float(value)
+        self.min_confidence = float(min_confidence)
+        self.window = max(1, int(window))
+
+    def new_state(self):
+        return {"active": False, "counts": deque(maxlen=self.window), "total": 0}
+
+    def evaluate(self, state, results, timestamp):
+        detections = results.get("objects_detected")
+        if not isinstance(detections, list):
+            return NOT_APPLICABLE
+        count = sum(
+            1 for d in detections
+            if d.get("class") in self.classes and d.get("confidence", 0.0) >= self.min_confidence
+        )
+        counts = state["counts"]
+        if len(counts) == counts.maxlen:
+            state["total"] -= counts[0]
+        counts.append(count)
+        state["total"] += count
+        total = state["total"]
+        return float(total) if self.op(total, self.value) else None
+
+
+RULE_TYPES = {
+    "threshold": ThresholdRule,
+    "rate_of_change": RateOfChangeRule,
+    "class_count": ClassCountRule,
+}
+
+
+def compile_rule(spec: dict) -> BaseRule:
+    """
+    Build a rule from its JSON specification
+
+    Args:
+        spec: Dict with a "type" key (threshold, rate_of_change, class_count)
+              and the constructor arguments of the matching rule class
+
+    Returns:
+        A compiled rule instance
+    """
+    spec = dict(spec)
+    rule_type = spec.pop("type", None)
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"Rule type '{rule_type}' not supported. Available types: {list(RULE_TYPES.keys())}")
+    return RULE_TYPES[rule_type](**spec)
+
+
+def load_rules(path: str) -> List[BaseRule]:
+    """Load and compile rules from a JSON file containing a list of specs"""
+    with open(path) as f:
+        specs = json.load(f)
+    return [compile_rule(spec) for spec in specs]
+
+
+# Destinos dos alertas
+class LogSink:
+    """Writes alerts to the application log"""
+
+    def send(self, alert: dict):
+        logger.warning(f"Alerta [{alert['severity']}] {alert['rule']} em {alert['source']}: {alert['message']}")
+
+
+class FileSink:
+    """Appends alerts as JSON lines to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, alert: dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(alert) + "\n")
+
+
+class WebhookSink:
+    """POSTs alerts as JSON to an HTTP endpoint"""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alert: dict):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(alert).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class AlertDispatcher:
+    """Delivers alerts to sinks from a background thread
+
+    ``dispatch`` never blocks: when the queue is full the alert is dropped
+    and a warning is logged.
+    """
+
+    def __init__(self, sinks: List[Any], max_queue: int = 1000):
+        self.sinks = sinks
+        self.queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self.thread.start()
+
+    def dispatch(self, alert: dict):
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            logger.warning(f"Fila de alertas cheia, descartando alerta {alert['rule']}")
+
+    def _run(self):
+        while True:
+            alert = self.queue.get()
+            try:
+                if alert is None:
+                    return
+                for sink in self.sinks:
+                    try:
+                        sink.send(alert)
+                    except Exception as e:
+                        logger.error(f"Error sending alert to {type(sink).__name__}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait until every queued alert has been delivered"""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class AlertEngine:
+    """Evaluates compiled rules incrementally as analyses complete
+
+    State is kept per (rule, source) and is bounded by the rule's window, so
+    evaluating a result costs the same no matter how many came before.
+    """
+
+    def __init__(self, rules: List[BaseRule], dispatcher: Optional[AlertDispatcher] = None,
+                 history_size: int = 100):
+        self.rules = rules
+        self.dispatcher = dispatcher
+        self.state: Dict[tuple, dict] = {}
+        self.history: deque = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+
+    def process(self, source: str, analysis_type: str, results: dict,
+                analysis_id: Optional[str] = None, timestamp: Optional[float] = None) -> List[dict]:
+        """
+        Feed one analysis result to every applicable rule
+
+        Args:
+            source: Identifier of the image source (e.g. a camera)
+            analysis_type: Type of the analysis that produced the results
+            results: Results returned by the vision model
+            analysis_id: Analysis that produced the results, if any
+            timestamp: Time of the result in seconds (defaults to now)
+
+        Returns:
+            The alerts triggered by this result
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        alerts = []
+        with self.lock:
+            for index, rule in enumerate(self.rules):
+                if not rule.applies_to(analysis_type):
+                    continue
+                key = (index, source)
+                state = self.state.get(key)
+                if state is None:
+                    state = self.state[key] = rule.new_state()
+                observed = rule.evaluate(state, results, timestamp)
+                if observed is NOT_APPLICABLE:
+                    # Leave the state untouched: a result without the field neither clears nor fires the rule
+                    continue
+                if observed is None:
+                    state["active"] = False
+                    continue
+                if state["active"]:
+                    continue
+                state["active"] = True
+                alerts.append(self._build_alert(rule, source, analysis_type, analysis_id, observed, timestamp))
+            self.history.extend(alerts)
+
+        if self.dispatcher:
+            for alert in alerts:
+                self.dispatcher.dispatch(alert)
+        return alerts
+
+    def recent(self) -> List[dict]:
+        """Return the most recent alerts, newest first"""
+        with self.lock:
+            return list(reversed(self.history))
+
+    def _build_alert(self, rule, source, analysis_type, analysis_id, observed, timestamp):
+        message = rule.message or f"{rule.name}: valor observado {observed:g}"
+        return {
+            "rule": rule.name,
+            "severity": rule.severity,
+            "source": source,
+            "analysis_type": analysis_type,
+            "analysis_id": analysis_id,
+            "value": observed,
+            "message": message,
+            "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+        }
+
+
+def create_engine_from_env() -> AlertEngine:
+    """
+    Build the alert engine configured by environment variables
+
+    ALERT_RULES_FILE: JSON file with the rule specs (no rules if unset)
+    ALERT_LOG_FILE: JSON lines file receiving alerts
+    ALERT_WEBHOOK_URL: URL receiving alerts via POST
+    """
+    rules_file = os.getenv("ALERT_RULES_FILE")
+    rules = []
+    if rules_file:
+        try:
+            rules = load_rules(rules_file)
+            logger.info(f"{len(rules)} regras de alerta carregadas de {rules_file}")
+        except Exception as e:
+            logger.error(f"Erro ao carregar regras de alerta: {str(e)}")
+
+    sinks: List[Any] = [LogSink()]
+    if os.getenv("ALERT_LOG_FILE"):
+        sinks.append(FileSink(os.getenv("ALERT_LOG_FILE")))
+    if os.getenv("ALERT_WEBHOOK_URL"):
+        sinks.append(WebhookSink(os.getenv("ALERT_WEBHOOK_URL")))
+
+    return AlertEngine(rules, AlertDispatcher(sinks))
@@ -7,17 +7,22 @@ import cv2
 import numpy as np
 import os
 import shutil
-from datetime import datetime
+from datetime import datetime, timezone
 import logging
 from typing import List, Optional
 import json
+import uuid
 from pydantic import BaseModel
 import time
 from pathlib import Path
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
-from database import get_db, Image, Analysis, init_db
+from database import get_db, Image, Analysis, init_db, DEPLOYMENT_MODE
 import models as vision_models
+import alerts
+import storage
+import cluster
+import roi as roi_masks
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -33,15 +38,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger("visao_envx")
 
+# Diretórios de dados (em modo distribuído devem apontar para armazenamento compartilhado)
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+RESULTS_DIR = os.getenv("RESULTS_DIR", "results")
+
 # Create necessary directories
-os.makedirs("uploads", exist_ok=True)
-os.makedirs("results", exist_ok=True)
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(RESULTS_DIR, exist_ok=True)
 os.makedirs("models", exist_ok=True)
 os.makedirs("static", exist_ok=True)
 
 # Inicializar banco de dados
 init_db()
 
+# Inicializar motor de alertas
+alert_engine = alerts.create_engine_from_env()
+
 # Obter origens permitidas
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://localhost:8000").split(",")
 
@@ -60,6 +72,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Gerenciador de ciclo de vida do armazenamento (desativado sem políticas)
+lifecycle_policy = storage.LifecyclePolicy.from_env()
+lifecycle_manager = None
+
+@app.on_event("startup")
+def start_storage_lifecycle():
+    global lifecycle_manager
+    if lifecycle_policy.enabled:
+        interval = float(os.getenv("STORAGE_LIFECYCLE_INTERVAL", "3600"))
+        # Nodes share the database and files in distributed mode: only the leader runs passes
+        should_run = None
+        if DEPLOYMENT_MODE == "distributed":
+            should_run = lambda: cluster_node is not None and cluster_node.is_leader
+        lifecycle_manager = storage.StorageLifecycleManager(
+            lifecycle_policy,
+            results_dir=RESULTS_DIR,
+            interval=interval,
+            should_run=should_run
+        )
+        lifecycle_manager.start()
+
+@app.on_event("shutdown")
+def stop_storage_lifecycle():
+    if lifecycle_manager:
+        lifecycle_manager.stop()
+
+# Nó do cluster (apenas em modo distribuído)
+cluster_node = None
+
+@app.on_event("startup")
+def start_cluster_node():
+    global cluster_node
+    if DEPLOYMENT_MODE == "distributed":
+        cluster_node = cluster.ClusterNode.from_env(process_image)
+        cluster_node.start()
+
+@app.on_event("shutdown")
+def stop_cluster_node():
+    if cluster_node:
+        cluster_node.stop()
+
 # Mount static files directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -81,15 +134,25 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    health = {"status": "healthy", "timestamp": datetime.now().isoformat(), "mode": DEPLOYMENT_MODE}
+    if cluster_node:
+        health["node_id"] = cluster_node.node_id
+        health["role"] = "leader" if cluster_node.is_leader else "follower"
+    return health
+
+@app.get("/cluster")
+async def cluster_status():
+    if not cluster_node:
+        raise HTTPException(status_code=404, detail="Cluster não habilitado (DEPLOYMENT_MODE=standalone)")
+    return cluster_node.status()
 
 @app.post("/upload")
 async def upload_image(file: UploadFile = File(...), db: Session = Depends(get_db)):
     try:
-        # Generate unique filename
+        # Generate unique filename (unique across nodes sharing the upload directory)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{file.filename}"
-        file_path = os.path.join("uploads", filename)
+        filename = f"{timestamp}_{uuid.uuid4().hex[:8]}_{file.filename}"
+        file_path = os.path.join(UPLOAD_DIR, filename)
         
         # Save uploaded file
         with open(file_path, "wb") as buffer:
@@ -139,7 +202,7 @@ async def analyze_image(
         db_image = db.query(Image).filter(Image.filename == image_id).first()
         if not db_image:
             # Check if image exists in filesystem as fallback
-            file_path = os.path.join("uploads", image_id)
+            file_path = os.path.join(UPLOAD_DIR, image_id)
             if not os.path.exists(file_path):
                 raise HTTPException(status_code=404, detail="Imagem não encontrada")
             
@@ -161,7 +224,7 @@ async def analyze_image(
             db.refresh(db_image)
         
         # Create analysis ID
-        analysis_id = f"analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        analysis_id = f"analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
         
         # Create analysis record in database
         db_analysis = Analysis(
@@ -176,14 +239,26 @@ async def analyze_image(
         db.commit()
         db.refresh(db_analysis)
         
-        # Process in background
-        background_tasks.add_task(
-            process_image, 
-            analysis_id, 
-            db_image.file_path, 
-            request.analysis_type,
-            request.parameters
-        )
+        if DEPLOYMENT_MODE == "distributed":
+            # Any worker node can pick the job up from the shared queue
+            source = (request.parameters or {}).get("source", "default")
+            cluster.enqueue_job(
+                db,
+                analysis_id,
+                str(source),
+                db_image.file_path,
+                request.analysis_type,
+                request.parameters
+            )
+        else:
+            # Process in background
+            background_tasks.add_task(
+                process_image, 
+                analysis_id, 
+                db_image.file_path, 
+                request.analysis_type,
+                request.parameters
+            )
         
         return {"analysis_id": analysis_id, "status": "processing"}
     
@@ -223,6 +298,16 @@ async def list_results(db: Session = Depends(get_db)):
     
     return results
 
+@app.get("/alerts")
+async def list_alerts():
+    # O histórico fica em memória em cada nó; no modo distribuído ele seria parcial
+    if DEPLOYMENT_MODE == "distributed":
+        raise HTTPException(
+            status_code=404,
+            detail="Histórico de alertas indisponível no modo distribuído; use ALERT_LOG_FILE ou ALERT_WEBHOOK_URL"
+        )
+    return alert_engine.recent()
+
 # Function for image processing
 def process_image(analysis_id: str, image_path: str, analysis_type: str, parameters: Optional[dict] = None):
     # Obter sessão do banco de dados
@@ -235,8 +320,12 @@ def process_image(analysis_id: str, image_path: str, analysis_type: str, paramet
             logger.error(f"Analysis {analysis_id} not found in database")
             return
         
-        # Read image
-        img = cv2.imread(image_path)
+        # The lifecycle manager may have recompressed or moved the file since the request
+        if db_analysis.image is not None:
+            image_path = db_analysis.image.file_path
+        
+        # Read image (cold files are fetched on demand)
+        img = cv2.imread(storage.resolve_path(image_path))
         if img is None:
             db_analysis.status = "failed"
             db_analysis.error = "Não foi possível ler a imagem"
@@ -252,8 +341,18 @@ def process_image(analysis_id: str, image_path: str, analysis_type: str, paramet
             db.commit()
             return
         
+        # Restrict the analysis to the camera or request ROI, if any
+        source = str((parameters or {}).get("source", "default"))
+        try:
+            roi = roi_masks.resolve_roi(parameters, source, img.shape[:2])
+        except (ValueError, TypeError) as e:
+            db_analysis.status = "failed"
+            db_analysis.error = f"ROI inválida: {str(e)}"
+            db.commit()
+            return
+        
         # Run prediction
-        results = model.predict(img)
+        results = model.predict(img, roi=roi)
         
         # Save results to database
         db_analysis.results = results
@@ -262,10 +361,21 @@ def process_image(analysis_id: str, image_path: str, analysis_type: str, paramet
         db.commit()
         
         # Save results to file as backup
-        result_path = os.path.join("results", f"{analysis_id}.json")
+        result_path = os.path.join(RESULTS_DIR, f"{analysis_id}.json")
         with open(result_path, "w") as f:
             json.dump(results, f)
         
+        # Evaluate alert rules against the new results
+        try:
+            # Use the request time, not completion time, so backlogs processed in bursts keep their real spacing
+            created_at = db_analysis.created_at
+            if created_at is not None and created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)  # SQLite returns naive UTC
+            timestamp = created_at.timestamp() if created_at is not None else None
+            alert_engine.process(source, analysis_type, results, analysis_id=analysis_id, timestamp=timestamp)
+        except Exception as e:
+            logger.error(f"Error evaluating alerts for {analysis_id}: {str(e)}")
+        
     except Exception as e:
         logger.error(f"Error processing image {analysis_id}: {str(e)}")
         
@@ -0,0 +1,358 @@
+import os
+import bisect
+import hashlib
+import logging
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import or_
+from database import SessionLocal, Analysis, Job, WorkerNode
+
+logger = logging.getLogger("visao_envx.cluster")
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping sources to worker nodes
+
+    Each node is placed ``replicas`` times on the ring so that adding or
+    removing a node only moves the sources it owns.
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 64):
+        self.nodes = sorted(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def get_node(self, key: str) -> Optional[str]:
+        """Return the node owning key, or None for an empty ring"""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+
+def default_node_id() -> str:
+    return os.getenv("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def enqueue_job(db, analysis_id: str, source: str, image_path: str, analysis_type: str,
+                parameters: Optional[dict] = None) -> Job:
+    """Add an analysis to the shared job queue"""
+    job = Job(
+        analysis_id=analysis_id,
+        source=source,
+        image_path=image_path,
+        analysis_type=analysis_type,
+        parameters=parameters,
+        status="queued",
+        attempts=0,
+        created_at=datetime.now(timezone.utc)
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+class ClusterNode:
+    """Membership, leader election and job claiming for one node
+
+    Every node writes a heartbeat to ``worker_nodes``. Nodes running workers
+    form a consistent hash ring and only claim queued jobs whose source they
+    own, so per-source state (such as alert windows) stays on one node. When
+    a node dies the ring changes and its sources move to the others; the
+    leader (the oldest live node) requeues jobs it was running. Setting
+    ``stale_after`` lets any worker take jobs queued longer than that, trading
+    source affinity for throughput on overloaded nodes (disabled by default).
+    """
+
+    def __init__(
+        self,
+        processor: Optional[Callable] = None,
+        node_id: Optional[str] = None,
+        session_factory=SessionLocal,
+        runs_workers: bool = True,
+        worker_threads: int = 2,
+        heartbeat_interval: float = 5,
+        node_timeout: float = 30,
+        stale_after: float = 0,
+        poll_interval: float = 1,
+        max_attempts: int = 3
+    ):
+        self.processor = processor
+        self.node_id = node_id or default_node_id()
+        self.session_factory = session_factory
+        self.runs_workers = runs_workers
+        self.worker_threads = worker_threads
+        self.heartbeat_interval = heartbeat_interval
+        self.node_timeout = node_timeout
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.started_at = datetime.now(timezone.utc)
+        self.is_leader = False
+        self._ring: Optional[HashRing] = None
+        self._running = 0
+        self._running_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls, processor: Optional[Callable] = None) -> "ClusterNode":
+        return cls(
+            processor=processor,
+            runs_workers=os.getenv("RUN_WORKERS", "true").lower() in ("true", "1", "t"),
+            worker_threads=int(os.getenv("WORKER_THREADS", "2")),
+            heartbeat_interval=float(os.getenv("HEARTBEAT_INTERVAL", "5")),
+            node_timeout=float(os.getenv("NODE_TIMEOUT", "30")),
+            stale_after=float(os.getenv("JOB_STALE_AFTER", "0"))
+        )
+
+    # Ciclo de vida
+    def start(self):
+        self.heartbeat()
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._heartbeat_loop, name="cluster-heartbeat", daemon=True)]
+        if self.runs_workers:
+            self._executor = ThreadPoolExecutor(max_workers=self.worker_threads, thread_name_prefix="analysis-worker")
+            self._threads.append(threading.Thread(target=self._worker_loop, name="cluster-worker", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Nó {self.node_id} iniciado (workers: {self.runs_workers})")
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        db = self.session_factory()
+        try:
+            db.query(WorkerNode).filter(WorkerNode.node_id == self.node_id).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Error sending heartbeat: {str(e)}")
+
+    def _worker_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Error polling jobs: {str(e)}")
+
+    # Membros do cluster
+    def heartbeat(self, now: Optional[datetime] = None):
+        """Record this node as alive and refresh the leader flag"""
+        now = now or datetime.now(timezone.utc)
+        db = self.session_factory()
+        try:
+            node = db.get(WorkerNode, self.node_id)
+            if node is None:
+                node = WorkerNode(
+                    node_id=self.node_id,
+                    hostname=socket.gethostname(),
+                    runs_workers=self.runs_workers,
+                    started_at=self.started_at
+                )
+                db.add(node)
+            node.last_heartbeat = now
+            db.commit()
+
+            nodes = self._alive_nodes(db, now)
+            self.is_leader = bool(nodes) and nodes[0].node_id == self.node_id
+            if self.is_leader:
+                self._recover_orphaned_jobs(db, nodes, now)
+        finally:
+            db.close()
+
+    def _alive_nodes(self, db, now: datetime) -> List[WorkerNode]:
+        """Live nodes, oldest first (the first one is the leader)"""
+        cutoff = now - timedelta(seconds=self.node_timeout)
+        return (
+            db.query(WorkerNode)
+            .filter(WorkerNode.last_heartbeat >= cutoff)
+            .order_by(WorkerNode.started_at, WorkerNode.node_id)
+            .all()
+        )
+
+    def _recover_orphaned_jobs(self, db, nodes: List[WorkerNode], now: datetime):
+        """Requeue jobs claimed by nodes that stopped sending heartbeats
+
+        Jobs that already used all their attempts are failed instead: a frame
+        that crashes the worker process would otherwise take down every node
+        that owns its source in turn.
+        """
+        alive = [node.node_id for node in nodes]
+        orphaned = (Job.status == "running", Job.worker_id.notin_(alive))
+
+        exhausted = [
+            analysis_id for (analysis_id,) in
+            db.query(Job.analysis_id).filter(*orphaned, Job.attempts >= self.max_attempts).all()
+        ]
+        if exhausted:
+            db.query(Job).filter(Job.analysis_id.in_(exhausted)).update(
+                {"status": "failed", "worker_id": None}, synchronize_session=False
+            )
+            db.query(Analysis).filter(
+                Analysis.analysis_id.in_(exhausted), Analysis.status == "processing"
+            ).update(
+                {"status": "failed", "error": "O worker foi interrompido durante a análise em todas as tentativas"},
+                synchronize_session=False
+            )
+            logger.error(f"{len(exhausted)} jobs falharam após {self.max_attempts} tentativas interrompidas")
+
+        requeued = (
+            db.query(Job)
+            .filter(*orphaned)
+            .update({"status": "queued", "worker_id": None, "claimed_at": None}, synchronize_session=False)
+        )
+        cutoff = now - timedelta(seconds=self.node_timeout * 10)
+        db.query(WorkerNode).filter(WorkerNode.last_heartbeat < cutoff).delete(synchronize_session=False)
+        db.commit()
+        if requeued:
+            logger.warning(f"{requeued} jobs de nós inativos foram recolocados na fila")
+
+    def ring(self, db, now: Optional[datetime] = None) -> HashRing:
+        """Hash ring of the live worker nodes"""
+        now = now or datetime.now(timezone.utc)
+        workers = [node.node_id for node in self._alive_nodes(db, now) if node.runs_workers]
+        if self._ring is None or self._ring.nodes != sorted(workers):
+            self._ring = HashRing(workers)
+        return self._ring
+
+    def status(self) -> Dict:
+        """Cluster view used by the health endpoints"""
+        now = datetime.now(timezone.utc)
+        db = self.session_factory()
+        try:
+            nodes = self._alive_nodes(db, now)
+            queued = db.query(Job).filter(Job.status == "queued").count()
+            running = db.query(Job).filter(Job.status == "running").count()
+        finally:
+            db.close()
+        return {
+            "node_id": self.node_id,
+            "leader": nodes[0].node_id if nodes else None,
+            "is_leader": self.is_leader,
+            "nodes": [
+                {
+                    "node_id": node.node_id,
+                    "hostname": node.hostname,
+                    "runs_workers": node.runs_workers,
+                    "last_heartbeat": node.last_heartbeat.isoformat() if node.last_heartbeat else None
+                }
+                for node in nodes
+            ],
+            "jobs": {"queued": queued, "running": running}
+        }
+
+    # Distribuição de trabalho
+    def claim(self, limit: int, now: Optional[datetime] = None) -> List[Job]:
+        """
+        Claim up to limit queued jobs owned by this node
+
+        Args:
+            limit: Maximum number of jobs to claim
+            now: Reference time (defaults to the current UTC time)
+
+        Returns:
+            The claimed jobs, detached from the session
+        """
+        now = now or datetime.now(timezone.utc)
+        db = self.session_factory()
+        try:
+            ring = self.ring(db, now)
+            # Ownership is filtered in SQL so another node's backlog never hides this node's jobs
+            queued_sources = db.query(Job.source).filter(Job.status == "queued").distinct().all()
+            owned = [source for (source,) in queued_sources if ring.get_node(source or "") == self.node_id]
+            claimable = Job.source.in_(owned)
+            if self.stale_after > 0:
+                claimable = or_(claimable, Job.created_at <= now - timedelta(seconds=self.stale_after))
+            candidates = (
+                db.query(Job.id)
+                .filter(Job.status == "queued", Job.attempts < self.max_attempts, claimable)
+                .order_by(Job.id)
+                .limit(limit * 2)
+                .all()
+            )
+            claimed_ids = []
+            for (job_id,) in candidates:
+                if len(claimed_ids) >= limit:
+                    break
+                # Conditional update: only one node can move the job out of "queued"
+                updated = (
+                    db.query(Job)
+                    .filter(Job.id == job_id, Job.status == "queued")
+                    .update(
+                        {"status": "running", "worker_id": self.node_id, "claimed_at": now, "attempts": Job.attempts + 1},
+                        synchronize_session=False
+                    )
+                )
+                db.commit()
+                if updated:
+                    claimed_ids.append(job_id)
+            if not claimed_ids:
+                return []
+            claimed = db.query(Job).filter(Job.id.in_(claimed_ids)).order_by(Job.id).all()
+            db.expunge_all()
+            return claimed
+        finally:
+            db.close()
+
+    def poll(self) -> int:
+        """Claim as many jobs as there are free worker threads and run them"""
+        with self._running_lock:
+            free = self.worker_threads - self._running
+        if free <= 0:
+            return 0
+        jobs = self.claim(free)
+        for job in jobs:
+            with self._running_lock:
+                self._running += 1
+            self._executor.submit(self._run_job, job)
+        return len(jobs)
+
+    def _run_job(self, job: Job):
+        try:
+            self.run_job(job)
+        finally:
+            with self._running_lock:
+                self._running -= 1
+
+    def run_job(self, job: Job):
+        """Run a claimed job and remove it from the queue"""
+        db = self.session_factory()
+        try:
+            try:
+                self.processor(job.analysis_id, job.image_path, job.analysis_type, job.parameters)
+            except Exception as e:
+                logger.error(f"Error running job {job.analysis_id}: {str(e)}")
+                status = "queued" if job.attempts < self.max_attempts else "failed"
+                db.query(Job).filter(Job.id == job.id).update(
+                    {"status": status, "worker_id": None}, synchronize_session=False
+                )
+                if status == "failed":
+                    # Out of retries: the analysis will never complete, so report it
+                    db.query(Analysis).filter(
+                        Analysis.analysis_id == job.analysis_id, Analysis.status == "processing"
+                    ).update({"status": "failed", "error": str(e)}, synchronize_session=False)
+            else:
+                db.query(Job).filter(Job.id == job.id).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
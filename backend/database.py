@@ -19,8 +19,11 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
+# Modo de implantação: "standalone" (padrão) ou "distributed"
+DEPLOYMENT_MODE = os.getenv("DEPLOYMENT_MODE", "standalone").lower()
+
 # Criar string de conexão
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 # Criar engine do SQLAlchemy
 try:
@@ -28,6 +31,9 @@ try:
     logger.info("Conexão com o banco de dados estabelecida com sucesso")
 except Exception as e:
     logger.error(f"Erro ao conectar ao banco de dados: {str(e)}")
+    # Nós distribuídos precisam compartilhar o banco; um SQLite local quebraria a distribuição
+    if DEPLOYMENT_MODE == "distributed":
+        raise
     # Fallback para SQLite em memória em caso de erro
     logger.warning("Usando SQLite em memória como fallback")
     DATABASE_URL = "sqlite:///./test.db"
@@ -68,6 +74,30 @@ class Analysis(Base):
     completed_at = Column(DateTime(timezone=True), nullable=True)
     image = relationship("Image", back_populates="analyses")
 
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    analysis_id = Column(String, unique=True, index=True)
+    source = Column(String, index=True)
+    image_path = Column(String)
+    analysis_type = Column(String)
+    parameters = Column(JSON, nullable=True)
+    status = Column(String, index=True)  # "queued", "running", "failed"
+    worker_id = Column(String, nullable=True, index=True)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+
+class WorkerNode(Base):
+    __tablename__ = "worker_nodes"
+
+    node_id = Column(String, primary_key=True)
+    hostname = Column(String)
+    runs_workers = Column(Boolean, default=True)
+    started_at = Column(DateTime(timezone=True))
+    last_heartbeat = Column(DateTime(timezone=True), index=True)
+
 # Função para obter sessão do banco de dados
 def get_db():
     db = SessionLocal()
@@ -3,7 +3,13 @@ import numpy as np
 import os
 import logging
 from typing import Dict, List, Tuple, Any, Optional
-import time
+import ast
+import threading
+
+try:
+    import onnxruntime as ort
+except ImportError:  # OpenCV DNN is used instead
+    ort = None
 
 logger = logging.getLogger("visao_envx.models")
 
@@ -19,8 +25,8 @@ class BaseVisionModel:
         """Load the model into memory"""
         raise NotImplementedError("Subclasses must implement load()")
     
-    def predict(self, image):
-        """Run prediction on an image"""
+    def predict(self, image, roi=None):
+        """Run prediction on an image, restricted to roi (a roi.CompiledROI) if given"""
         raise NotImplementedError("Subclasses must implement predict()")
     
     def preprocess(self, image):
@@ -50,26 +56,28 @@ class ColorAnalyzer(BaseVisionModel):
             return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
         return image
     
-    def predict(self, image):
+    def predict(self, image, roi=None):
         """Analyze colors in the image"""
         image = self.preprocess(image)
+        mask = None
+        if roi is not None:
+            image = roi.crop(image)
+            mask = roi.mask
         
         # Calculate average color
-        avg_color_per_row = np.average(image, axis=0)
-        avg_color = np.average(avg_color_per_row, axis=0)
+        avg_b, avg_g, avg_r = cv2.mean(image, mask=mask)[:3]
         
         # Calculate color histogram
         hist = {}
         for i, color in enumerate(['b', 'g', 'r']):
-            hist[color] = cv2.calcHist([image], [i], None, [256], [0, 256])
+            hist[color] = cv2.calcHist([image], [i], mask, [256], [0, 256])
         
         # Determine dominant color
-        avg_b, avg_g, avg_r = avg_color
         dominant = "green" if avg_g > avg_r and avg_g > avg_b else \
                   "blue" if avg_b > avg_r and avg_b > avg_g else \
                   "red"
         
-        return {
+        results = {
             "average_color": {
                 "b": float(avg_b),
                 "g": float(avg_g),
@@ -82,6 +90,9 @@ class ColorAnalyzer(BaseVisionModel):
                 "r": hist['r'].flatten().tolist()
             }
         }
+        if roi is not None:
+            results["roi"] = roi.to_dict()
+        return results
     
     def postprocess(self, prediction):
         # Already in the right format
@@ -103,19 +114,22 @@ class VegetationAnalyzer(BaseVisionModel):
         # Ensure image is in BGR format
         return image
     
-    def predict(self, image):
+    def predict(self, image, roi=None):
         """Calculate vegetation indices"""
         # This is a simplified mock implementation
         # In a real system, you would use NIR (Near Infrared) bands
         # Here we're just using the regular RGB channels as a demonstration
         
-        # Extract blue, green, and red channels
-        b, g, r = cv2.split(image)
+        # Restrict to the ROI: a cropped view, then only the masked pixels
+        if roi is not None:
+            image = roi.crop(image)
+        if roi is not None and roi.mask is not None:
+            pixels = image[roi.mask > 0]
+        else:
+            pixels = image.reshape(-1, 3)
         
-        # Convert to float for calculations
-        b = b.astype(float)
-        g = g.astype(float)
-        r = r.astype(float)
+        # Extract blue, green, and red channels, as float for calculations
+        b, g, r = pixels.astype(float).T
         
         # Calculate pseudo-NDVI using (NIR-Red)/(NIR+Red)
         # Since we don't have NIR, we'll use green as a proxy (not accurate, just for demo)
@@ -145,87 +159,344 @@ class VegetationAnalyzer(BaseVisionModel):
         vegetation_pixels = np.sum(vegetation_mask)
         coverage_percentage = (vegetation_pixels / total_pixels) * 100
         
-        return {
+        results = {
             "ndvi_average": ndvi_mean,
             "ndvi_std": ndvi_std,
             "vegetation_health": health,
             "coverage_percentage": float(coverage_percentage),
             "exg_average": float(np.mean(exg))
         }
+        if roi is not None:
+            results["roi"] = roi.to_dict()
+        return results
     
     def postprocess(self, prediction):
         return prediction
 
 
 class ObjectDetector(BaseVisionModel):
-    """Mock object detector class"""
+    """YOLO-style object detector running an ONNX model on CPU
+
+    Uses ONNX Runtime when available and falls back to OpenCV DNN. Both
+    YOLOv5 (1, N, 5 + classes) and YOLOv8 (1, 4 + classes, N) outputs are
+    supported; the format comes from DETECTION_OUTPUT_FORMAT, the model
+    metadata, or the label count as a last resort. Quantized (INT8) and
+    FP16 models are loaded the same way; the input blob is allocated with
+    the dtype the model expects.
+    """
     
-    def __init__(self, model_path: Optional[str] = None):
-        super().__init__(model_path)
-        self.classes = [
-            "tree", "plant", "water", "building", "vehicle", 
-            "person", "animal", "waste", "fire", "smoke"
-        ]
+    OUTPUT_FORMATS = ("auto", "yolov5", "yolov8")
+    
+    DEFAULT_CLASSES = [
+        "tree", "plant", "water", "building", "vehicle", 
+        "person", "animal", "waste", "fire", "smoke"
+    ]
+    
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        backend: Optional[str] = None,
+        conf_threshold: Optional[float] = None,
+        nms_threshold: Optional[float] = None,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+        input_size: Optional[Tuple[int, int]] = None,
+        output_format: Optional[str] = None,
+        max_detections: int = 100
+    ):
+        super().__init__(model_path or os.getenv("DETECTION_MODEL_PATH", os.path.join("models", "detector.onnx")))
+        self.backend = (backend or os.getenv("DETECTION_BACKEND", "auto")).lower()
+        self.conf_threshold = conf_threshold if conf_threshold is not None else float(os.getenv("DETECTION_CONFIDENCE", "0.25"))
+        self.nms_threshold = nms_threshold if nms_threshold is not None else float(os.getenv("DETECTION_NMS", "0.45"))
+        self.intra_op_threads = intra_op_threads if intra_op_threads is not None else int(os.getenv("INFERENCE_INTRA_THREADS", "0"))
+        self.inter_op_threads = inter_op_threads if inter_op_threads is not None else int(os.getenv("INFERENCE_INTER_THREADS", "0"))
+        self.output_format = (output_format or os.getenv("DETECTION_OUTPUT_FORMAT", "auto")).lower()
+        if self.output_format not in self.OUTPUT_FORMATS:
+            raise ValueError(f"Output format '{self.output_format}' not supported. Available formats: {list(self.OUTPUT_FORMATS)}")
+        self.max_detections = max_detections
+        self.classes = list(self.DEFAULT_CLASSES)
+        self.requested_input_size = input_size  # (width, height)
+        self.input_size = input_size or (640, 640)
+        self.input_name = None
+        self.input_dtype = np.float32
+        self.lock = threading.Lock()
+        # Buffers reused between frames
+        self._canvas = None
+        self._blob = None
+        self._letterbox_key = None
     
     def load(self):
-        """Mock loading a model"""
-        logger.info("Loading object detection model...")
-        # Simulate model loading time
-        time.sleep(1)
+        """Load the ONNX model into the selected backend"""
+        if not self.model_path or not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Detection model not found: {self.model_path}")
+        
+        logger.info(f"Loading object detection model from {self.model_path}...")
+        
+        # Optional class names file next to the model (one per line)
+        names_path = os.path.splitext(self.model_path)[0] + ".names"
+        has_names_file = os.path.exists(names_path)
+        if has_names_file:
+            with open(names_path) as f:
+                self.classes = [line.strip() for line in f if line.strip()]
+        
+        use_ort = self.backend in ("auto", "onnxruntime") and ort is not None
+        if self.backend == "onnxruntime" and ort is None:
+            raise RuntimeError("onnxruntime is not installed")
+        
+        if use_ort:
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.intra_op_threads > 0:
+                options.intra_op_num_threads = self.intra_op_threads
+            if self.inter_op_threads > 0:
+                options.inter_op_num_threads = self.inter_op_threads
+            self.model = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+            model_input = self.model.get_inputs()[0]
+            self.input_name = model_input.name
+            if model_input.type == "tensor(float16)":
+                self.input_dtype = np.float16
+            shape = model_input.shape
+            self._read_metadata(self.model.get_modelmeta().custom_metadata_map, has_names_file)
+            self.backend = "onnxruntime"
+        else:
+            if self.intra_op_threads > 0:
+                cv2.setNumThreads(self.intra_op_threads)
+            self.model = cv2.dnn.readNetFromONNX(self.model_path)
+            self.model.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.model.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            shape = None
+            self.backend = "opencv"
+        
+        # Explicit size, then the model's fixed size, then 640x640 for dynamic shapes
+        if self.requested_input_size:
+            self.input_size = tuple(self.requested_input_size)
+        elif shape and len(shape) == 4 and isinstance(shape[2], int) and isinstance(shape[3], int):
+            self.input_size = (shape[3], shape[2])
+        else:
+            self.input_size = (
+                int(os.getenv("DETECTION_INPUT_WIDTH", "640")),
+                int(os.getenv("DETECTION_INPUT_HEIGHT", "640"))
+            )
+        
+        self._canvas = np.full((self.input_size[1], self.input_size[0], 3), 114, dtype=np.uint8)
+        self._blob = np.empty((1, 3, self.input_size[1], self.input_size[0]), dtype=self.input_dtype)
+        self._letterbox_key = None
         self.is_loaded = True
-        logger.info("Object detection model loaded")
+        logger.info(f"Object detection model loaded ({self.backend}, input {self.input_size[0]}x{self.input_size[1]})")
         return True
     
-    def preprocess(self, image):
-        """Preprocess image for object detection"""
-        # Resize to expected input size (mock)
-        resized = cv2.resize(image, (416, 416))
-        return resized
+    def _read_metadata(self, metadata: Dict[str, str], has_names_file: bool):
+        """Take labels and output format from Ultralytics export metadata"""
+        if "names" in metadata and not has_names_file:
+            try:
+                names = ast.literal_eval(metadata["names"])
+                if isinstance(names, dict):
+                    names = [names[key] for key in sorted(names)]
+                self.classes = [str(name) for name in names]
+            except (ValueError, SyntaxError):
+                logger.warning("Could not parse class names from model metadata")
+        if self.output_format == "auto":
+            # YOLOv8 exports record the task; YOLOv5 exports only stride and names
+            if "task" in metadata:
+                self.output_format = "yolov8"
+            elif "names" in metadata or "stride" in metadata:
+                self.output_format = "yolov5"
     
-    def predict(self, image):
-        """Run mock object detection"""
-        if not self.is_loaded:
-            self.load()
+    def _decode_layout(self, pred: np.ndarray) -> Tuple[np.ndarray, str]:
+        """Return the (N, 4 or 5 + classes) predictions and their format"""
+        output_format = self.output_format
+        num_labels = len(self.classes)
         
-        processed_image = self.preprocess(image)
+        if output_format == "yolov5":
+            # Native layout is already (N, 5 + classes)
+            pass
+        elif output_format == "yolov8":
+            # Native layout is (4 + classes, N)
+            if pred.shape[0] < pred.shape[1]:
+                pred = pred.T
+        elif pred.shape[1] == 5 + num_labels:
+            output_format = "yolov5"
+        elif pred.shape[0] == 4 + num_labels:
+            output_format, pred = "yolov8", pred.T
+        elif pred.shape[1] == 4 + num_labels:
+            output_format = "yolov8"
+        else:
+            raise ValueError(
+                f"Cannot decode detection output of shape {pred.shape} with {num_labels} labels: "
+                "set DETECTION_OUTPUT_FORMAT and provide the labels in a .names file next to the model"
+            )
+        
+        num_classes = pred.shape[1] - (5 if output_format == "yolov5" else 4)
+        if num_classes != num_labels:
+            raise ValueError(
+                f"Model outputs {num_classes} classes but {num_labels} labels are configured; "
+                "provide the labels in a .names file next to the model"
+            )
+        return pred, output_format
+    
+    def preprocess(self, image):
+        """Letterbox the image into the model input and build the NCHW blob
+
+        Returns the blob plus the scale and padding needed to map boxes back.
+        """
+        if len(image.shape) == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
         
-        # Mock detection results
-        # In a real implementation, this would run the model
         height, width = image.shape[:2]
+        in_w, in_h = self.input_size
+        scale = min(in_w / width, in_h / height)
+        new_w, new_h = int(round(width * scale)), int(round(height * scale))
+        left, top = (in_w - new_w) // 2, (in_h - new_h) // 2
         
-        # Generate some random detections for demonstration
-        num_detections = np.random.randint(1, 5)
-        detections = []
+        # Padding only needs to be reset when the geometry changes
+        key = (width, height)
+        if key != self._letterbox_key:
+            self._canvas.fill(114)
+            self._letterbox_key = key
         
-        for _ in range(num_detections):
-            # Random class
-            class_id = np.random.randint(0, len(self.classes))
-            class_name = self.classes[class_id]
+        region = self._canvas[top:top + new_h, left:left + new_w]
+        resized = cv2.resize(image, (new_w, new_h), dst=region, interpolation=cv2.INTER_LINEAR)
+        if resized is not region:
+            region[...] = resized
+        
+        # BGR -> RGB, HWC -> CHW, scale to [0, 1]
+        np.multiply(self._canvas[:, :, ::-1].transpose(2, 0, 1), 1.0 / 255.0, out=self._blob[0])
+        return self._blob, scale, (left, top)
+    
+    def predict(self, image, roi=None):
+        """Run object detection on the image
+
+        With an ROI only its bounding rectangle is fed to the model; boxes
+        are mapped back to full-frame coordinates and those centered outside
+        the mask are dropped.
+        """
+        crop = roi.crop(image) if roi is not None else image
+        
+        with self.lock:
+            if not self.is_loaded:
+                self.load()
             
-            # Random confidence
-            confidence = np.random.uniform(0.6, 0.98)
+            blob, scale, padding = self.preprocess(crop)
             
-            # Random bounding box
-            x = np.random.randint(0, width - 100)
-            y = np.random.randint(0, height - 100)
-            w = np.random.randint(50, min(200, width - x))
-            h = np.random.randint(50, min(200, height - y))
+            if self.backend == "onnxruntime":
+                output = self.model.run(None, {self.input_name: blob})[0]
+            else:
+                self.model.setInput(blob)
+                output = self.model.forward()
             
+            results = self.postprocess(output, scale, padding, crop.shape[:2])
+        
+        if roi is None:
+            return results
+        
+        x0, y0 = roi.bbox[:2]
+        detections = []
+        for detection in results["objects_detected"]:
+            x, y, w, h = detection["bbox"]
+            if roi.mask is not None:
+                cx = min(x + w // 2, roi.mask.shape[1] - 1)
+                cy = min(y + h // 2, roi.mask.shape[0] - 1)
+                if not roi.mask[cy, cx]:
+                    continue
+            detection["bbox"] = [x + x0, y + y0, w, h]
+            detections.append(detection)
+        
+        return {
+            "objects_detected": detections,
+            "count": len(detections),
+            "roi": roi.to_dict()
+        }
+    
+    def postprocess(self, prediction, scale=1.0, padding=(0, 0), image_shape=None):
+        """Decode raw model output into filtered, non-overlapping detections"""
+        pred = np.asarray(prediction, dtype=np.float32)
+        if pred.ndim == 3:
+            pred = pred[0]
+        
+        pred, output_format = self._decode_layout(pred)
+        
+        if output_format == "yolov5":
+            scores = pred[:, 5:] * pred[:, 4:5]
+        else:
+            scores = pred[:, 4:]
+        
+        class_ids = np.argmax(scores, axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= self.conf_threshold
+        if not np.any(keep):
+            return {"objects_detected": [], "count": 0}
+        
+        boxes = pred[keep, :4]
+        class_ids = class_ids[keep]
+        confidences = confidences[keep]
+        
+        # (cx, cy, w, h) in input space -> (x1, y1, x2, y2) in image space
+        xyxy = np.empty_like(boxes)
+        xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+        xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+        xyxy[:, [0, 2]] -= padding[0]
+        xyxy[:, [1, 3]] -= padding[1]
+        xyxy /= scale
+        if image_shape is not None:
+            height, width = image_shape
+            xyxy[:, [0, 2]] = np.clip(xyxy[:, [0, 2]], 0, width)
+            xyxy[:, [1, 3]] = np.clip(xyxy[:, [1, 3]], 0, height)
+        
+        indices = non_max_suppression(xyxy, confidences, class_ids, self.nms_threshold)[:self.max_detections]
+        
+        detections = []
+        for i in indices:
+            x1, y1, x2, y2 = xyxy[i]
+            class_id = int(class_ids[i])
             detections.append({
-                "class": class_name,
-                "confidence": float(confidence),
-                "bbox": [int(x), int(y), int(w), int(h)]
+                "class": self.classes[class_id],
+                "confidence": float(confidences[i]),
+                "bbox": [int(round(x1)), int(round(y1)), int(round(x2 - x1)), int(round(y2 - y1))]
             })
         
         return {
             "objects_detected": detections,
             "count": len(detections)
         }
+
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, iou_threshold: float) -> List[int]:
+    """
+    Class-aware greedy NMS over (x1, y1, x2, y2) boxes
     
-    def postprocess(self, prediction):
-        """Postprocess detection results"""
-        return prediction
+    Boxes of different classes are offset apart so a single pass handles all
+    classes; the IoU of each kept box against the remaining ones is computed
+    in one vectorized step.
+    
+    Returns:
+        Indices of the kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return []
+    
+    offset = class_ids.astype(np.float32)[:, None] * (float(boxes.max()) + 1.0)
+    shifted = boxes + offset
+    x1, y1, x2, y2 = shifted[:, 0], shifted[:, 1], shifted[:, 2], shifted[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind="stable")
+    
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(int(i))
+        rest = order[1:]
+        inter_w = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        inter_h = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    
+    return keep
+
 
+# Loaded models are shared so the detector is only loaded once per process
+_model_cache: Dict[str, BaseVisionModel] = {}
+_model_cache_lock = threading.Lock()
 
 # Factory function to get the appropriate model
 def get_model(model_type: str) -> BaseVisionModel:
@@ -236,7 +507,7 @@ def get_model(model_type: str) -> BaseVisionModel:
         model_type: Type of model to return
         
     Returns:
-        An instance of the requested model
+        A shared instance of the requested model
     """
     models = {
         "color_analysis": ColorAnalyzer,
@@ -247,4 +518,7 @@ def get_model(model_type: str) -> BaseVisionModel:
     if model_type not in models:
         raise ValueError(f"Model type '{model_type}' not supported. Available types: {list(models.keys())}")
     
-    return models[model_type]() 
\ No newline at end of file
+    with _model_cache_lock:
+        if model_type not in _model_cache:
+            _model_cache[model_type] = models[model_type]()
+        return _model_cache[model_type] 
\ No newline at end of file
@@ -0,0 +1,182 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import cv2
+import numpy as np
+
+logger = logging.getLogger("visao_envx.roi")
+
+# Limite de memória das máscaras compiladas (uma máscara 4K ocupa ~8 MB)
+ROI_CACHE_MB = float(os.getenv("ROI_CACHE_MB", "64"))
+
+
+class CompiledROI:
+    """Region of interest compiled for a given frame size
+
+    ``bbox`` is the bounding rectangle (x, y, w, h) of the region. ``mask``
+    covers only that rectangle and is None when every pixel inside it is
+    relevant, so analyzers can work on a cropped view without masking.
+    Instances are cached and shared, so the mask is read-only.
+    """
+
+    def __init__(self, bbox: Tuple[int, int, int, int], mask: Optional[np.ndarray], pixel_count: int):
+        self.bbox = bbox
+        self.mask = mask
+        self.pixel_count = pixel_count
+
+    def crop(self, image: np.ndarray) -> np.ndarray:
+        """Return a view of the image restricted to the bounding rectangle"""
+        x, y, w, h = self.bbox
+        return image[y:y + h, x:x + w]
+
+    def to_dict(self) -> dict:
+        return {"bbox": list(self.bbox), "pixels": self.pixel_count}
+
+
+def _scale_polygons(polygons, width: int, height: int, normalized: bool):
+    scale = np.array([width, height], dtype=np.float64) if normalized else np.ones(2)
+    result = []
+    for polygon in polygons:
+        points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if len(points) < 3:
+            raise ValueError("ROI polygons need at least 3 points")
+        result.append(np.round(points * scale).astype(np.int32))
+    return result
+
+
+class _ROICache:
+    """LRU cache of compiled ROIs bounded by the bytes held in masks"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[tuple, Tuple[Optional[CompiledROI], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[0]
+
+    def put(self, key: tuple, compiled: Optional[CompiledROI]):
+        nbytes = compiled.mask.nbytes if compiled is not None and compiled.mask is not None else 0
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (compiled, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+_cache = _ROICache(int(ROI_CACHE_MB * 1024 * 1024))
+
+
+def _compile(spec_key: str, height: int, width: int) -> Optional[CompiledROI]:
+    spec = json.loads(spec_key)
+    normalized = spec.get("roi_normalized")
+    if normalized is None:
+        normalized = False
+    elif not isinstance(normalized, bool):
+        raise ValueError(f"roi_normalized must be true or false, got {normalized!r}")
+    include = spec.get("roi") or []
+    exclude = spec.get("roi_exclude") or []
+    if not include and not exclude:
+        return None
+
+    if include:
+        mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.fillPoly(mask, _scale_polygons(include, width, height, normalized), 255)
+    else:
+        mask = np.full((height, width), 255, dtype=np.uint8)
+    if exclude:
+        cv2.fillPoly(mask, _scale_polygons(exclude, width, height, normalized), 0)
+
+    x, y, w, h = cv2.boundingRect(mask)
+    if w == 0 or h == 0:
+        raise ValueError("ROI does not cover any pixel of the image")
+
+    cropped = mask[y:y + h, x:x + w]
+    pixel_count = int(cv2.countNonZero(cropped))
+    if pixel_count == w * h:
+        # Rectangular region: cropping alone is enough
+        cropped = None
+    else:
+        cropped = cropped.copy()
+        cropped.flags.writeable = False
+    return CompiledROI((x, y, w, h), cropped, pixel_count)
+
+
+def compile_roi(spec: dict, shape: Tuple[int, int]) -> Optional[CompiledROI]:
+    """
+    Compile an ROI specification into a cached crop and bitmask
+
+    Args:
+        spec: Dict with "roi" (polygons to analyze), "roi_exclude" (polygons
+              to ignore, e.g. burned-in timestamps) and "roi_normalized"
+              (coordinates in the 0-1 range instead of pixels)
+        shape: (height, width) of the frames the ROI applies to
+
+    Returns:
+        The compiled ROI, or None when the spec does not restrict the frame
+
+    Compiled ROIs are cached up to ROI_CACHE_MB megabytes of masks.
+    """
+    spec_key = json.dumps(
+        {key: spec.get(key) for key in ("roi", "roi_exclude", "roi_normalized")},
+        sort_keys=True
+    )
+    key = (spec_key, int(shape[0]), int(shape[1]))
+    found, compiled = _cache.get(key)
+    if not found:
+        compiled = _compile(*key)
+        _cache.put(key, compiled)
+    return compiled
+
+
+_camera_rois: Optional[Dict[str, dict]] = None
+
+
+def get_camera_roi(source: str) -> dict:
+    """
+    Return the ROI configured for a camera source
+
+    Camera ROIs are read once from the JSON file in ROI_CONFIG_FILE, which
+    maps each source to a spec accepted by compile_roi.
+    """
+    global _camera_rois
+    if _camera_rois is None:
+        _camera_rois = {}
+        config_file = os.getenv("ROI_CONFIG_FILE")
+        if config_file:
+            try:
+                with open(config_file) as f:
+                    _camera_rois = json.load(f)
+                logger.info(f"ROIs de {len(_camera_rois)} câmeras carregadas de {config_file}")
+            except Exception as e:
+                logger.error(f"Erro ao carregar ROIs das câmeras: {str(e)}")
+    return _camera_rois.get(source, {})
+
+
+def resolve_roi(parameters: Optional[dict], source: str, shape: Tuple[int, int]) -> Optional[CompiledROI]:
+    """Compile the ROI for an analysis; request parameters override the camera ROI"""
+    parameters = parameters or {}
+    spec = dict(get_camera_roi(source))
+    for key in ("roi", "roi_exclude", "roi_normalized"):
+        if key in parameters:
+            spec[key] = parameters[key]
+    return compile_roi(spec, shape)
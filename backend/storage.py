@@ -0,0 +1,400 @@
+import os
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+import cv2
+from sqlalchemy import func, or_
+from database import SessionLocal, Image, Analysis
+
+logger = logging.getLogger("visao_envx.storage")
+
+# Prefixo dos caminhos de arquivos movidos para o armazenamento frio
+COLD_PREFIX = "cold://"
+
+# Imagens com análises em andamento não podem ser movidas nem apagadas
+NOT_IN_FLIGHT = ~Image.analyses.any(Analysis.status == "processing")
+
+# Formatos sem perda que podem ser recomprimidos
+LOSSLESS_EXTENSIONS = (".png", ".bmp", ".tif", ".tiff")
+
+
+class ObjectStore:
+    """Base class for cold storage backends"""
+
+    def put(self, key: str, local_path: str):
+        """Upload a local file under key"""
+        raise NotImplementedError("Subclasses must implement put()")
+
+    def get(self, key: str, local_path: str):
+        """Download the object stored under key to a local file"""
+        raise NotImplementedError("Subclasses must implement get()")
+
+    def delete(self, key: str):
+        """Remove the object stored under key, if any"""
+        raise NotImplementedError("Subclasses must implement delete()")
+
+    def exists(self, key: str) -> bool:
+        """Check whether an object exists under key"""
+        raise NotImplementedError("Subclasses must implement exists()")
+
+
+class LocalDirectoryStore(ObjectStore):
+    """Object store backed by a local (or mounted) directory"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def put(self, key, local_path):
+        target = self._path(key)
+        tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, target)
+
+    def get(self, key, local_path):
+        shutil.copyfile(self._path(key), local_path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+
+_default_store: Optional[ObjectStore] = None
+
+
+def get_object_store() -> ObjectStore:
+    """
+    Return the cold storage backend configured by environment variables
+
+    STORAGE_BACKEND: Backend type (only "local" for now)
+    STORAGE_COLD_DIR: Root directory for the "local" backend
+    """
+    global _default_store
+    if _default_store is None:
+        backends = {
+            "local": lambda: LocalDirectoryStore(os.getenv("STORAGE_COLD_DIR", "cold_storage"))
+        }
+        backend = os.getenv("STORAGE_BACKEND", "local")
+        if backend not in backends:
+            raise ValueError(f"Storage backend '{backend}' not supported. Available backends: {list(backends.keys())}")
+        _default_store = backends[backend]()
+    return _default_store
+
+
+def is_cold(path: Optional[str]) -> bool:
+    return bool(path) and path.startswith(COLD_PREFIX)
+
+
+def resolve_path(path: str, store: Optional[ObjectStore] = None, cache_dir: Optional[str] = None) -> str:
+    """
+    Return a local path for a stored file, fetching cold files on demand
+
+    Args:
+        path: Local path or cold path (cold://<key>) as stored in Image.file_path
+        store: Cold storage backend (defaults to the configured one)
+        cache_dir: Directory holding local copies of cold files
+
+    Returns:
+        A path that can be opened locally
+    """
+    if not is_cold(path):
+        return path
+
+    key = path[len(COLD_PREFIX):]
+    cache_dir = cache_dir or os.getenv("STORAGE_CACHE_DIR", "cache")
+    local_path = os.path.join(cache_dir, key)
+    if not os.path.exists(local_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{local_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            (store or get_object_store()).get(key, tmp_path)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    else:
+        # Manter arquivos usados recentemente no cache
+        os.utime(local_path)
+    return local_path
+
+
+class LifecyclePolicy:
+    """Retention, recompression and tiering settings
+
+    A value of 0 disables the corresponding step.
+    """
+
+    def __init__(
+        self,
+        retention_days: float = 0,
+        max_storage_mb: float = 0,
+        recompress_after_days: float = 0,
+        recompress_quality: int = 90,
+        cold_after_days: float = 0,
+        cache_ttl_hours: float = 24,
+        batch_size: int = 500
+    ):
+        self.retention_days = retention_days
+        self.max_storage_mb = max_storage_mb
+        self.recompress_after_days = recompress_after_days
+        self.recompress_quality = recompress_quality
+        self.cold_after_days = cold_after_days
+        self.cache_ttl_hours = cache_ttl_hours
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_env(cls) -> "LifecyclePolicy":
+        return cls(
+            retention_days=float(os.getenv("STORAGE_RETENTION_DAYS", "0")),
+            max_storage_mb=float(os.getenv("STORAGE_MAX_MB", "0")),
+            recompress_after_days=float(os.getenv("STORAGE_RECOMPRESS_AFTER_DAYS", "0")),
+            recompress_quality=int(os.getenv("STORAGE_RECOMPRESS_QUALITY", "90")),
+            cold_after_days=float(os.getenv("STORAGE_COLD_AFTER_DAYS", "0")),
+            cache_ttl_hours=float(os.getenv("STORAGE_CACHE_TTL_HOURS", "24")),
+            batch_size=int(os.getenv("STORAGE_BATCH_SIZE", "500"))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return any((self.retention_days, self.max_storage_mb, self.recompress_after_days, self.cold_after_days))
+
+
+class StorageLifecycleManager:
+    """Applies a LifecyclePolicy to uploads/, results/ and the database
+
+    ``run_once`` performs a single pass; ``start`` repeats it from a
+    background thread every ``interval`` seconds. While ``should_run``
+    returns False (e.g. on nodes that are not the leader) only the local
+    read-through cache is trimmed.
+    """
+
+    def __init__(
+        self,
+        policy: LifecyclePolicy,
+        store: Optional[ObjectStore] = None,
+        session_factory=SessionLocal,
+        results_dir: str = "results",
+        cache_dir: Optional[str] = None,
+        interval: float = 3600,
+        should_run: Optional[Callable[[], bool]] = None
+    ):
+        self.policy = policy
+        self.store = store or get_object_store()
+        self.session_factory = session_factory
+        self.results_dir = results_dir
+        self.cache_dir = cache_dir or os.getenv("STORAGE_CACHE_DIR", "cache")
+        self.interval = interval
+        self.should_run = should_run
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-lifecycle", daemon=True)
+        self._thread.start()
+        logger.info("Gerenciador de ciclo de vida do armazenamento iniciado")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # The cache is local to each node, so it is trimmed even when shared steps are skipped
+                self.run_once(shared=self.should_run is None or self.should_run())
+            except Exception as e:
+                logger.error(f"Error running storage lifecycle: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def run_once(self, now: Optional[datetime] = None, shared: bool = True) -> Dict[str, int]:
+        """
+        Run every enabled lifecycle step once
+
+        Args:
+            now: Reference time (defaults to the current UTC time)
+            shared: Run the steps that change the shared database and files;
+                    when False only this node's read-through cache is trimmed
+
+        Returns:
+            Number of images affected by each step
+        """
+        now = now or datetime.now(timezone.utc)
+        stats = {"expired": 0, "recompressed": 0, "moved_to_cold": 0, "evicted": 0, "cache_cleared": 0}
+        db = self.session_factory() if shared else None
+        try:
+            if shared and self.policy.retention_days:
+                cutoff = now - timedelta(days=self.policy.retention_days)
+                stats["expired"] = self._delete_where(db, Image.created_at < cutoff)
+            if shared and self.policy.recompress_after_days:
+                stats["recompressed"] = self._recompress(db, now - timedelta(days=self.policy.recompress_after_days))
+            if shared and self.policy.cold_after_days:
+                stats["moved_to_cold"] = self._move_to_cold(db, now - timedelta(days=self.policy.cold_after_days))
+            if shared and self.policy.max_storage_mb:
+                stats["evicted"] = self._enforce_size(db)
+        finally:
+            if db is not None:
+                db.close()
+        stats["cache_cleared"] = self._clear_cache(now)
+        if any(stats.values()):
+            logger.info(f"Ciclo de vida do armazenamento: {stats}")
+        return stats
+
+    def _local_images(self, db, cutoff: datetime, limit: int, after_id: int, *conditions) -> List[Image]:
+        return (
+            db.query(Image)
+            .filter(
+                Image.created_at < cutoff,
+                Image.id > after_id,
+                ~Image.file_path.startswith(COLD_PREFIX),
+                NOT_IN_FLIGHT,
+                *conditions
+            )
+            .order_by(Image.id)
+            .limit(limit)
+            .all()
+        )
+
+    def _recompress(self, db, cutoff: datetime) -> int:
+        """Re-encode old lossless originals as JPEG"""
+        lossless = or_(*[func.lower(Image.file_path).endswith(ext) for ext in LOSSLESS_EXTENSIONS])
+        count = 0
+        last_id = 0
+        while True:
+            images = self._local_images(db, cutoff, self.policy.batch_size, last_id, lossless)
+            if not images:
+                return count
+            last_id = images[-1].id
+            removed = []
+            for image in images:
+                root = os.path.splitext(image.file_path)[0]
+                img = cv2.imread(image.file_path)
+                if img is None:
+                    continue
+                # Include the image id so the new file cannot replace another upload
+                new_path = f"{root}.{image.id}.jpg"
+                if os.path.exists(new_path):
+                    logger.warning(f"Skipping recompression of {image.file_path}: {new_path} already exists")
+                    continue
+                if not cv2.imwrite(new_path, img, [cv2.IMWRITE_JPEG_QUALITY, self.policy.recompress_quality]):
+                    continue
+                removed.append(image.file_path)
+                image.file_path = new_path
+                image.file_size = os.path.getsize(new_path)
+                count += 1
+            db.commit()
+            self._remove_files(removed)
+
+    def _move_to_cold(self, db, cutoff: datetime) -> int:
+        """Move old local originals to the cold store"""
+        count = 0
+        last_id = 0
+        while True:
+            images = self._local_images(db, cutoff, self.policy.batch_size, last_id)
+            if not images:
+                return count
+            last_id = images[-1].id
+            removed = []
+            for image in images:
+                if not image.file_path or not os.path.exists(image.file_path):
+                    continue
+                key = os.path.basename(image.file_path)
+                self.store.put(key, image.file_path)
+                removed.append(image.file_path)
+                image.file_path = COLD_PREFIX + key
+                count += 1
+            # Only drop local copies once the new paths are committed
+            db.commit()
+            self._remove_files(removed)
+
+    def _enforce_size(self, db) -> int:
+        """Delete the oldest images until local uploads fit the size limit"""
+        local = ~Image.file_path.startswith(COLD_PREFIX)
+        total = db.query(func.coalesce(func.sum(Image.file_size), 0)).filter(local).scalar()
+        excess = total - self.policy.max_storage_mb * 1024 * 1024
+        count = 0
+        while excess > 0:
+            rows = (
+                db.query(Image.id, Image.file_size)
+                .filter(local, NOT_IN_FLIGHT)
+                .order_by(Image.created_at, Image.id)
+                .limit(self.policy.batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            ids = []
+            for image_id, file_size in rows:
+                ids.append(image_id)
+                excess -= file_size or 0
+                if excess <= 0:
+                    break
+            count += self._delete_images(db, ids)
+        return count
+
+    def _delete_where(self, db, condition) -> int:
+        count = 0
+        while True:
+            ids = [row[0] for row in db.query(Image.id).filter(condition, NOT_IN_FLIGHT).limit(self.policy.batch_size).all()]
+            if not ids:
+                return count
+            count += self._delete_images(db, ids)
+
+    def _delete_images(self, db, ids: List[int]) -> int:
+        """Delete images with their analyses and files in a single transaction"""
+        file_paths = [row[0] for row in db.query(Image.file_path).filter(Image.id.in_(ids)).all()]
+        analysis_ids = [row[0] for row in db.query(Analysis.analysis_id).filter(Analysis.image_id.in_(ids)).all()]
+
+        db.query(Analysis).filter(Analysis.image_id.in_(ids)).delete(synchronize_session=False)
+        db.query(Image).filter(Image.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+
+        for path in file_paths:
+            if is_cold(path):
+                key = path[len(COLD_PREFIX):]
+                self.store.delete(key)
+                self._remove_files([os.path.join(self.cache_dir, key)])
+            elif path:
+                self._remove_files([path])
+        self._remove_files([os.path.join(self.results_dir, f"{analysis_id}.json") for analysis_id in analysis_ids])
+        return len(ids)
+
+    def _clear_cache(self, now: datetime) -> int:
+        """Remove local copies of cold files not read recently or deleted from the store"""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        cutoff = now.timestamp() - self.policy.cache_ttl_hours * 3600
+        count = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file():
+                continue
+            expired = entry.stat().st_mtime < cutoff
+            # Copies of images deleted by another node's lifecycle pass
+            deleted = not entry.name.endswith(".tmp") and not self.store.exists(entry.name)
+            if expired or deleted:
+                self._remove_files([entry.path])
+                count += 1
+        return count
+
+    def _remove_files(self, paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error removing {path}: {str(e)}")
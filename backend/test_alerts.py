@@ -0,0 +1,116 @@
+import pytest
+import json
+from alerts import (
+    AlertEngine, AlertDispatcher, FileSink, ThresholdRule, RateOfChangeRule,
+    ClassCountRule, compile_rule
+)
+
+def test_threshold_rule_is_edge_triggered():
+    """Test that a threshold rule alerts once per crossing"""
+    rule = ThresholdRule("low_coverage", "coverage_percentage", "<", 20, analysis_type="vegetation_index")
+    engine = AlertEngine([rule])
+
+    assert engine.process("cam1", "vegetation_index", {"coverage_percentage": 50}) == []
+    alerts = engine.process("cam1", "vegetation_index", {"coverage_percentage": 10})
+    assert len(alerts) == 1
+    assert alerts[0]["rule"] == "low_coverage"
+    assert alerts[0]["source"] == "cam1"
+    # Still below threshold, no new alert
+    assert engine.process("cam1", "vegetation_index", {"coverage_percentage": 5}) == []
+    # Re-arm and trigger again
+    engine.process("cam1", "vegetation_index", {"coverage_percentage": 30})
+    assert len(engine.process("cam1", "vegetation_index", {"coverage_percentage": 15})) == 1
+
+def test_rules_filtered_by_analysis_type_and_source():
+    """Test that rules only see their analysis type and keep state per source"""
+    rule = ThresholdRule("low_coverage", "coverage_percentage", "<", 20, analysis_type="vegetation_index")
+    engine = AlertEngine([rule])
+
+    assert engine.process("cam1", "color_analysis", {"coverage_percentage": 10}) == []
+    assert len(engine.process("cam1", "vegetation_index", {"coverage_percentage": 10})) == 1
+    assert len(engine.process("cam2", "vegetation_index", {"coverage_percentage": 10})) == 1
+
+def test_other_analysis_types_do_not_rearm_rule():
+    """Test that results without the field leave an unfiltered rule untouched"""
+    rule = ThresholdRule("low_coverage", "coverage_percentage", "<", 20)
+    engine = AlertEngine([rule])
+
+    assert len(engine.process("cam1", "vegetation_index", {"coverage_percentage": 5})) == 1
+    assert engine.process("cam1", "color_analysis", {"dominant_color": "green"}) == []
+    assert engine.process("cam1", "vegetation_index", {"coverage_percentage": 5}) == []
+    engine.process("cam1", "vegetation_index", {"coverage_percentage": 50})
+    assert len(engine.process("cam1", "vegetation_index", {"coverage_percentage": 5})) == 1
+
+def test_rate_of_change_rule():
+    """Test the sliding window rate of change"""
+    rule = RateOfChangeRule("coverage_drop", "coverage_percentage", "<", -1.0, window=3)
+    engine = AlertEngine([rule])
+
+    assert engine.process("cam1", "vegetation_index", {"coverage_percentage": 80}, timestamp=0) == []
+    assert engine.process("cam1", "vegetation_index", {"coverage_percentage": 79}, timestamp=10) == []
+    alerts = engine.process("cam1", "vegetation_index", {"coverage_percentage": 40}, timestamp=20)
+    assert len(alerts) == 1
+    assert alerts[0]["value"] == pytest.approx(-2.0)
+
+def test_rate_of_change_uses_result_timestamps():
+    """Test that a burst of late results is measured by their own timestamps"""
+    rule = RateOfChangeRule("coverage_drop", "coverage_percentage", "<", -1.0, window=3)
+    engine = AlertEngine([rule])
+
+    # Processed back to back, but requested a minute apart
+    for i, coverage in enumerate([80, 70, 60]):
+        assert engine.process("cam1", "vegetation_index", {"coverage_percentage": coverage}, timestamp=60 * i) == []
+
+def test_class_count_rule():
+    """Test counting detections of given classes"""
+    rule = ClassCountRule("fire", ["fire", "smoke"], min_confidence=0.5)
+    engine = AlertEngine([rule])
+
+    results = {"objects_detected": [
+        {"class": "tree", "confidence": 0.9, "bbox": [0, 0, 10, 10]},
+        {"class": "smoke", "confidence": 0.4, "bbox": [0, 0, 10, 10]},
+    ]}
+    assert engine.process("cam1", "object_detection", results) == []
+
+    results["objects_detected"].append({"class": "fire", "confidence": 0.8, "bbox": [0, 0, 10, 10]})
+    alerts = engine.process("cam1", "object_detection", results)
+    assert len(alerts) == 1
+    assert alerts[0]["value"] == 1.0
+
+def test_class_count_window():
+    """Test that windowed counts sum the last N results"""
+    rule = ClassCountRule("smoke", ["smoke"], value=3, window=2)
+    engine = AlertEngine([rule])
+    smoke = {"objects_detected": [{"class": "smoke", "confidence": 0.9}] * 2}
+
+    assert engine.process("cam1", "object_detection", smoke) == []
+    assert len(engine.process("cam1", "object_detection", smoke)) == 1
+    engine.process("cam1", "object_detection", {"objects_detected": []})
+    engine.process("cam1", "object_detection", {"objects_detected": []})
+    assert engine.state[(0, "cam1")]["total"] == 0
+
+def test_compile_rule():
+    """Test building rules from JSON specs"""
+    rule = compile_rule({"type": "threshold", "name": "t", "field": "average_color.g", "op": ">", "value": 100})
+    assert isinstance(rule, ThresholdRule)
+    assert rule.path == ("average_color", "g")
+
+    with pytest.raises(ValueError):
+        compile_rule({"type": "unknown", "name": "x"})
+
+def test_dispatcher_delivers_to_sinks(tmp_path):
+    """Test that alerts reach the sinks from the background thread"""
+    path = tmp_path / "alerts.jsonl"
+    dispatcher = AlertDispatcher([FileSink(str(path))])
+    engine = AlertEngine([ClassCountRule("fire", ["fire"])], dispatcher)
+
+    engine.process("cam1", "object_detection", {"objects_detected": [{"class": "fire", "confidence": 0.9}]})
+    dispatcher.flush()
+    dispatcher.close()
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["rule"] == "fire"
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", "test_alerts.py"])
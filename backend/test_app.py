@@ -112,5 +112,13 @@ def test_list_results():
     assert isinstance(response.json(), list)
     assert len(response.json()) > 0
 
+def test_alerts_unavailable_in_distributed_mode(monkeypatch):
+    """Test that a node does not serve its partial alert history"""
+    assert client.get("/alerts").status_code == 200
+
+    monkeypatch.setattr("app.DEPLOYMENT_MODE", "distributed")
+    response = client.get("/alerts")
+    assert response.status_code == 404
+
 if __name__ == "__main__":
     pytest.main(["-xvs", "test_app.py"]) 
\ No newline at end of file
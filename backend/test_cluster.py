@@ -0,0 +1,189 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base, Analysis, Job
+from cluster import HashRing, ClusterNode, enqueue_job
+
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Shared database for the simulated nodes"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'cluster.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def make_node(session_factory, node_id, started_offset=0, **kwargs):
+    node = ClusterNode(node_id=node_id, session_factory=session_factory, **kwargs)
+    node.started_at = NOW + timedelta(seconds=started_offset)
+    return node
+
+def enqueue(session_factory, sources, created_at=NOW):
+    db = session_factory()
+    for i, source in enumerate(sources):
+        job = enqueue_job(db, f"analysis_{i}", source, f"uploads/{i}.jpg", "color_analysis")
+        job.created_at = created_at
+        db.commit()
+    db.close()
+
+def test_hash_ring_is_consistent():
+    """Test that removing a node only moves the sources it owned"""
+    sources = [f"cam{i}" for i in range(200)]
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b"])
+
+    owners = {source: before.get_node(source) for source in sources}
+    assert set(owners.values()) == {"a", "b", "c"}
+    for source in sources:
+        if owners[source] != "c":
+            assert after.get_node(source) == owners[source]
+
+    assert HashRing([]).get_node("cam1") is None
+
+def test_leader_is_oldest_live_node(session_factory):
+    """Test leader election and node expiry"""
+    first = make_node(session_factory, "node-a", 0)
+    second = make_node(session_factory, "node-b", 1)
+    first.heartbeat(NOW)
+    second.heartbeat(NOW)
+    assert first.is_leader and not second.is_leader
+
+    # node-a stops sending heartbeats
+    second.heartbeat(NOW + timedelta(seconds=60))
+    assert second.is_leader
+
+def test_jobs_are_claimed_by_source_owner(session_factory):
+    """Test that each job is claimed once, by the node owning its source"""
+    nodes = [make_node(session_factory, f"node-{i}", i) for i in range(3)]
+    for node in nodes:
+        node.heartbeat(NOW)
+    sources = [f"cam{i}" for i in range(30)]
+    enqueue(session_factory, sources)
+
+    ring = HashRing([node.node_id for node in nodes])
+    claimed = {}
+    for node in nodes:
+        for job in node.claim(100, NOW):
+            assert job.analysis_id not in claimed
+            claimed[job.analysis_id] = node.node_id
+            assert ring.get_node(job.source) == node.node_id
+
+    assert len(claimed) == len(sources)
+
+def test_backlog_does_not_hide_other_nodes_jobs(session_factory):
+    """Test that a node finds its jobs behind another node's backlog"""
+    node_a = make_node(session_factory, "node-a", 0)
+    node_b = make_node(session_factory, "node-b", 1)
+    node_a.heartbeat(NOW)
+    node_b.heartbeat(NOW)
+    ring = HashRing(["node-a", "node-b"])
+    source_a = next(f"cam{i}" for i in range(100) if ring.get_node(f"cam{i}") == "node-a")
+    source_b = next(f"cam{i}" for i in range(100) if ring.get_node(f"cam{i}") == "node-b")
+    enqueue(session_factory, [source_a] * 100 + [source_b], created_at=NOW - timedelta(hours=1))
+
+    claimed = node_b.claim(2, NOW)
+
+    # Only its own job, even though node-a's jobs are old
+    assert [job.source for job in claimed] == [source_b]
+
+def test_stale_jobs_can_be_claimed_by_any_worker(session_factory):
+    """Test takeover of jobs nobody claimed in time"""
+    owner = make_node(session_factory, "node-a", 0)
+    other = make_node(session_factory, "node-b", 1, stale_after=60)
+    owner.heartbeat(NOW)
+    other.heartbeat(NOW)
+    ring = HashRing(["node-a", "node-b"])
+    source = next(f"cam{i}" for i in range(100) if ring.get_node(f"cam{i}") == "node-a")
+    enqueue(session_factory, [source])
+
+    assert other.claim(10, NOW) == []
+    assert len(other.claim(10, NOW + timedelta(seconds=120))) == 1
+
+def test_leader_requeues_jobs_of_dead_nodes(session_factory):
+    """Test recovery of jobs claimed by a node that died"""
+    leader = make_node(session_factory, "node-a", 0)
+    worker = make_node(session_factory, "node-b", 1)
+    leader.heartbeat(NOW)
+    worker.heartbeat(NOW)
+    ring = HashRing(["node-a", "node-b"])
+    source = next(f"cam{i}" for i in range(100) if ring.get_node(f"cam{i}") == "node-b")
+    enqueue(session_factory, [source])
+    assert len(worker.claim(10, NOW)) == 1
+
+    leader.heartbeat(NOW + timedelta(seconds=60))
+
+    db = session_factory()
+    job = db.query(Job).first()
+    assert job.status == "queued"
+    assert job.worker_id is None
+    db.close()
+
+def test_leader_fails_dead_nodes_jobs_out_of_attempts(session_factory):
+    """Test that a job crashing its workers is failed instead of requeued forever"""
+    leader = make_node(session_factory, "node-a", 0, max_attempts=1)
+    worker = make_node(session_factory, "node-b", 1, max_attempts=1)
+    leader.heartbeat(NOW)
+    worker.heartbeat(NOW)
+    ring = HashRing(["node-a", "node-b"])
+    source = next(f"cam{i}" for i in range(100) if ring.get_node(f"cam{i}") == "node-b")
+    db = session_factory()
+    db.add(Analysis(analysis_id="analysis_0", analysis_type="color_analysis", status="processing"))
+    db.commit()
+    db.close()
+    enqueue(session_factory, [source])
+    assert len(worker.claim(10, NOW)) == 1
+
+    # node-b dies while running the job
+    leader.heartbeat(NOW + timedelta(seconds=60))
+
+    db = session_factory()
+    assert db.query(Job).first().status == "failed"
+    assert db.query(Analysis).first().status == "failed"
+    db.close()
+    assert leader.claim(10, NOW + timedelta(seconds=60)) == []
+
+def test_run_job_removes_it_from_queue(session_factory):
+    """Test running a claimed job through the processor"""
+    calls = []
+    node = make_node(session_factory, "node-a", processor=lambda *args: calls.append(args))
+    node.heartbeat(NOW)
+    enqueue(session_factory, ["cam1"])
+
+    job = node.claim(1, NOW)[0]
+    node.run_job(job)
+
+    assert calls == [("analysis_0", "uploads/0.jpg", "color_analysis", None)]
+    db = session_factory()
+    assert db.query(Job).count() == 0
+    db.close()
+
+def test_failed_job_marks_analysis_failed(session_factory):
+    """Test retries and the final failure of a job"""
+    def fail(*args):
+        raise RuntimeError("worker crashed")
+
+    node = make_node(session_factory, "node-a", processor=fail, max_attempts=2)
+    node.heartbeat(NOW)
+    db = session_factory()
+    db.add(Analysis(analysis_id="analysis_0", analysis_type="color_analysis", status="processing"))
+    db.commit()
+    db.close()
+    enqueue(session_factory, ["cam1"])
+
+    node.run_job(node.claim(1, NOW)[0])
+    db = session_factory()
+    assert db.query(Job).first().status == "queued"
+    assert db.query(Analysis).first().status == "processing"
+    db.close()
+
+    node.run_job(node.claim(1, NOW)[0])
+    db = session_factory()
+    assert db.query(Job).first().status == "failed"
+    analysis = db.query(Analysis).first()
+    assert analysis.status == "failed"
+    assert analysis.error == "worker crashed"
+    db.close()
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", "test_cluster.py"])
@@ -0,0 +1,157 @@
+import pytest
+import os
+import numpy as np
+import models
+from models import ObjectDetector, ColorAnalyzer, VegetationAnalyzer, non_max_suppression
+from roi import compile_roi
+
+TEST_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "tiny_detector.onnx")
+
+BACKENDS = ["opencv"]
+if models.ort is not None:
+    BACKENDS.append("onnxruntime")
+
+@pytest.fixture(params=BACKENDS)
+def detector(request):
+    """Detector loaded with the bundled test model"""
+    model = ObjectDetector(TEST_MODEL, backend=request.param, conf_threshold=0.5, input_size=(64, 64))
+    model.load()
+    return model
+
+def test_detects_fire_on_red_image(detector):
+    """Test a real detection from the bundled model"""
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    img[:, :, 2] = 255  # Red in BGR
+
+    results = detector.predict(img)
+
+    # The shifted duplicate box is removed by NMS
+    assert results["count"] == 1
+    detection = results["objects_detected"][0]
+    assert detection["class"] == "fire"
+    assert detection["confidence"] == pytest.approx(1.0, abs=1e-3)
+    assert detection["bbox"] == [8, 8, 16, 16]
+
+def test_letterbox_maps_boxes_back(detector):
+    """Test that boxes are mapped back to the original image size"""
+    img = np.zeros((64, 128, 3), dtype=np.uint8)
+    img[:, :, 1] = 255  # Green
+
+    results = detector.predict(img)
+
+    assert results["count"] == 1
+    detection = results["objects_detected"][0]
+    assert detection["class"] == "plant"
+    # Scale 0.5 with 16 px of vertical padding, clipped to the image
+    assert detection["bbox"] == [64, 32, 48, 32]
+
+def test_no_detections_below_threshold(detector):
+    """Test the confidence filter"""
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    assert detector.predict(img) == {"objects_detected": [], "count": 0}
+
+def test_missing_model():
+    """Test that a missing model raises instead of returning mock output"""
+    model = ObjectDetector("does_not_exist.onnx")
+    with pytest.raises(FileNotFoundError):
+        model.predict(np.zeros((10, 10, 3), dtype=np.uint8))
+
+COCO_LABELS = [f"label{i}" for i in range(80)]
+
+def test_decodes_yolov8_coco_output():
+    """Test a (1, 4 + 80, N) YOLOv8 output"""
+    detector = ObjectDetector(output_format="yolov8", conf_threshold=0.5)
+    detector.classes = COCO_LABELS
+    output = np.zeros((1, 84, 8400), dtype=np.float32)
+    output[0, :4, 7] = [100, 100, 20, 40]
+    output[0, 4 + 5, 7] = 0.9
+
+    results = detector.postprocess(output, image_shape=(640, 640))
+
+    assert results["count"] == 1
+    detection = results["objects_detected"][0]
+    assert detection["class"] == "label5"
+    assert detection["confidence"] == pytest.approx(0.9)
+    assert detection["bbox"] == [90, 80, 20, 40]
+
+def test_decodes_yolov5_coco_output():
+    """Test a (1, N, 5 + 80) YOLOv5 output, scaled by objectness"""
+    detector = ObjectDetector(output_format="yolov5", conf_threshold=0.5)
+    detector.classes = COCO_LABELS
+    output = np.zeros((1, 25200, 85), dtype=np.float32)
+    output[0, 3, :5] = [100, 100, 20, 40, 0.9]
+    output[0, 3, 5 + 5] = 1.0
+
+    results = detector.postprocess(output, image_shape=(640, 640))
+
+    assert results["count"] == 1
+    detection = results["objects_detected"][0]
+    assert detection["class"] == "label5"
+    assert detection["confidence"] == pytest.approx(0.9)
+
+def test_label_mismatch_raises():
+    """Test that outputs not matching the configured labels are rejected"""
+    output = np.zeros((1, 84, 8400), dtype=np.float32)
+
+    with pytest.raises(ValueError, match="DETECTION_OUTPUT_FORMAT"):
+        ObjectDetector().postprocess(output)
+    with pytest.raises(ValueError, match="80 classes but 10 labels"):
+        ObjectDetector(output_format="yolov8").postprocess(output)
+
+def test_non_max_suppression_is_class_aware():
+    """Test NMS keeps overlapping boxes of different classes"""
+    boxes = np.array([
+        [0, 0, 10, 10],
+        [1, 1, 11, 11],
+        [0, 0, 10, 10],
+        [50, 50, 60, 60],
+    ], dtype=np.float32)
+    scores = np.array([0.9, 0.8, 0.7, 0.6], dtype=np.float32)
+    class_ids = np.array([0, 0, 1, 0])
+
+    assert non_max_suppression(boxes, scores, class_ids, 0.5) == [0, 2, 3]
+
+def test_detector_roi_offsets_boxes(detector):
+    """Test that detection on an ROI crop reports full-frame boxes"""
+    img = np.zeros((200, 200, 3), dtype=np.uint8)
+    img[100:164, 50:114, 2] = 255
+    roi = compile_roi({"roi": [[[50, 100], [113, 100], [113, 163], [50, 163]]]}, img.shape[:2])
+
+    results = detector.predict(img, roi=roi)
+
+    assert results["count"] == 1
+    assert results["objects_detected"][0]["bbox"] == [58, 108, 16, 16]
+    assert results["roi"]["bbox"] == [50, 100, 64, 64]
+
+def test_color_analysis_ignores_masked_pixels():
+    """Test that color statistics only use ROI pixels"""
+    img = np.zeros((100, 100, 3), dtype=np.uint8)
+    img[:, :, 2] = 255  # Red frame
+    img[20:60, 20:60] = [0, 255, 0]  # Green area of interest
+    img[20:30, 20:30] = [255, 0, 0]  # Excluded blue corner
+    roi = compile_roi({
+        "roi": [[[20, 20], [59, 20], [59, 59], [20, 59]]],
+        "roi_exclude": [[[20, 20], [29, 20], [29, 29], [20, 29]]]
+    }, img.shape[:2])
+
+    results = ColorAnalyzer().predict(img, roi=roi)
+
+    assert results["dominant_color"] == "green"
+    assert results["average_color"]["g"] == pytest.approx(255.0)
+    assert sum(results["histograms"]["g"]) == roi.pixel_count
+
+def test_vegetation_roi_matches_cropped_image():
+    """Test that an ROI gives the same result as analyzing the region alone"""
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 255, (80, 120, 3), dtype=np.uint8)
+    roi = compile_roi({"roi": [[[30, 10], [89, 10], [89, 69], [30, 69]]]}, img.shape[:2])
+    analyzer = VegetationAnalyzer()
+
+    with_roi = analyzer.predict(img, roi=roi)
+    cropped = analyzer.predict(np.ascontiguousarray(img[10:70, 30:90]))
+
+    for key in ("ndvi_average", "ndvi_std", "coverage_percentage", "exg_average"):
+        assert with_roi[key] == pytest.approx(cropped[key])
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", "test_models.py"])
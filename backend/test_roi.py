@@ -0,0 +1,78 @@
+import pytest
+import numpy as np
+import roi
+from roi import compile_roi, resolve_roi
+
+SQUARE = [[10, 10], [30, 10], [30, 30], [10, 30]]
+TRIANGLE = [[0, 0], [40, 0], [0, 40]]
+
+def test_rectangular_roi_only_crops():
+    """Test that a rectangular ROI needs no mask"""
+    compiled = compile_roi({"roi": [SQUARE]}, (100, 100))
+
+    assert compiled.bbox == (10, 10, 21, 21)
+    assert compiled.mask is None
+    assert compiled.pixel_count == 21 * 21
+    assert compiled.crop(np.zeros((100, 100, 3))).shape == (21, 21, 3)
+
+def test_polygon_and_exclusion_mask():
+    """Test a polygon ROI with an excluded area"""
+    compiled = compile_roi({"roi": [TRIANGLE], "roi_exclude": [SQUARE]}, (100, 100))
+
+    assert compiled.bbox == (0, 0, 41, 41)
+    assert compiled.mask.shape == (41, 41)
+    assert compiled.mask[5, 5] == 255
+    assert compiled.mask[15, 15] == 0
+    assert compiled.mask[39, 39] == 0
+    assert not compiled.mask.flags.writeable
+
+def test_normalized_coordinates_and_cache():
+    """Test normalized coordinates and reuse of compiled ROIs"""
+    spec = {"roi": [[[0, 0], [0.5, 0], [0.5, 1], [0, 1]]], "roi_normalized": True}
+
+    compiled = compile_roi(spec, (50, 200))
+    assert compiled.bbox == (0, 0, 101, 50)
+    assert compile_roi(dict(spec), (50, 200)) is compiled
+    assert compile_roi(spec, (60, 200)) is not compiled
+
+def test_empty_specs_and_invalid_roi():
+    """Test specs that do not restrict or cover the frame"""
+    assert compile_roi({}, (10, 10)) is None
+    with pytest.raises(ValueError):
+        compile_roi({"roi": [[[200, 200], [300, 200], [300, 300]]]}, (10, 10))
+    with pytest.raises(ValueError):
+        compile_roi({"roi": [[[0, 0], [1, 1]]]}, (10, 10))
+
+def test_roi_normalized_must_be_boolean():
+    """Test that string flags like "false" are rejected instead of read as true"""
+    spec = {"roi": [[[0, 0], [0.5, 0], [0.5, 1], [0, 1]]]}
+
+    with pytest.raises(ValueError, match="roi_normalized"):
+        compile_roi(dict(spec, roi_normalized="false"), (50, 200))
+    with pytest.raises(ValueError, match="roi_normalized"):
+        compile_roi(dict(spec, roi_normalized=1), (50, 200))
+
+def test_cache_is_bounded_by_mask_bytes(monkeypatch):
+    """Test that the least recently used masks are evicted past the byte limit"""
+    monkeypatch.setattr(roi, "_cache", roi._ROICache(2 * 100 * 100))
+    spec = {"roi": [[[0, 0], [99, 0], [0, 99]]]}
+
+    first = compile_roi(spec, (100, 100))
+    second = compile_roi(spec, (100, 101))
+    assert compile_roi(spec, (100, 100)) is first
+    compile_roi(spec, (100, 102))
+
+    assert roi._cache.size <= 2 * 100 * 100
+    assert compile_roi(spec, (100, 100)) is first
+    assert compile_roi(spec, (100, 101)) is not second
+
+def test_request_overrides_camera_roi(monkeypatch):
+    """Test merging camera ROIs with request parameters"""
+    monkeypatch.setattr(roi, "_camera_rois", {"cam1": {"roi": [SQUARE]}})
+
+    assert resolve_roi(None, "cam1", (100, 100)).bbox == (10, 10, 21, 21)
+    assert resolve_roi({"roi": [TRIANGLE]}, "cam1", (100, 100)).bbox == (0, 0, 41, 41)
+    assert resolve_roi(None, "cam2", (100, 100)) is None
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", "test_roi.py"])
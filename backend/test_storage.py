@@ -0,0 +1,202 @@
+import pytest
+import os
+import json
+import time
+import cv2
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base, Image, Analysis
+import storage
+from storage import LifecyclePolicy, LocalDirectoryStore, StorageLifecycleManager, COLD_PREFIX
+
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def env(tmp_path):
+    """Isolated database, directories and cold store"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    dirs = {name: tmp_path / name for name in ("uploads", "results", "cold", "cache")}
+    for path in dirs.values():
+        path.mkdir()
+    store = LocalDirectoryStore(str(dirs["cold"]))
+    return session_factory, dirs, store
+
+def add_image(session_factory, dirs, name, age_days, ext=".png", analysis_id=None):
+    """Create an image file, its row and one analysis with a results file"""
+    analysis_id = analysis_id or f"analysis_{name}"
+    path = str(dirs["uploads"] / f"{name}{ext}")
+    img = np.random.randint(0, 255, (64, 64, 3), dtype=np.uint8)
+    cv2.imwrite(path, img)
+    db = session_factory()
+    image = Image(
+        filename=f"{name}{ext}",
+        original_filename=f"{name}{ext}",
+        file_path=path,
+        file_size=os.path.getsize(path),
+        width=64,
+        height=64,
+        created_at=NOW - timedelta(days=age_days)
+    )
+    db.add(image)
+    db.commit()
+    db.add(Analysis(analysis_id=analysis_id, image_id=image.id, analysis_type="color_analysis", status="completed"))
+    db.commit()
+    db.close()
+    with open(dirs["results"] / f"{analysis_id}.json", "w") as f:
+        json.dump({}, f)
+    return path
+
+def make_manager(env, **policy):
+    session_factory, dirs, store = env
+    return StorageLifecycleManager(
+        LifecyclePolicy(**policy),
+        store=store,
+        session_factory=session_factory,
+        results_dir=str(dirs["results"]),
+        cache_dir=str(dirs["cache"])
+    )
+
+def test_retention_deletes_rows_and_files(env):
+    """Test that expired images are removed with their analyses and files"""
+    session_factory, dirs, _ = env
+    old_path = add_image(session_factory, dirs, "old", 40)
+    new_path = add_image(session_factory, dirs, "new", 1)
+
+    stats = make_manager(env, retention_days=30, batch_size=1).run_once(NOW)
+
+    assert stats["expired"] == 1
+    assert not os.path.exists(old_path)
+    assert not os.path.exists(dirs["results"] / "analysis_old.json")
+    assert os.path.exists(new_path)
+    db = session_factory()
+    assert [i.filename for i in db.query(Image).all()] == ["new.png"]
+    assert [a.analysis_id for a in db.query(Analysis).all()] == ["analysis_new"]
+    db.close()
+
+def test_size_limit_evicts_oldest(env):
+    """Test that the oldest images are deleted to respect the size limit"""
+    session_factory, dirs, _ = env
+    paths = [add_image(session_factory, dirs, f"img{i}", 10 - i) for i in range(3)]
+    limit = os.path.getsize(paths[2]) / (1024 * 1024)
+
+    stats = make_manager(env, max_storage_mb=limit).run_once(NOW)
+
+    assert stats["evicted"] == 2
+    assert [os.path.exists(p) for p in paths] == [False, False, True]
+
+def test_recompress_old_lossless_images(env):
+    """Test that old PNG originals are re-encoded as JPEG"""
+    session_factory, dirs, _ = env
+    old_path = add_image(session_factory, dirs, "old", 10)
+    add_image(session_factory, dirs, "new", 1)
+
+    stats = make_manager(env, recompress_after_days=7).run_once(NOW)
+
+    assert stats["recompressed"] == 1
+    assert not os.path.exists(old_path)
+    db = session_factory()
+    image = db.query(Image).filter(Image.filename == "old.png").first()
+    assert image.file_path.endswith(".jpg")
+    assert image.file_size == os.path.getsize(image.file_path)
+    db.close()
+
+def test_recompress_does_not_overwrite_other_images(env):
+    """Test that a PNG and a JPEG sharing a base name both survive recompression"""
+    session_factory, dirs, _ = env
+    add_image(session_factory, dirs, "photo", 10, ext=".png")
+    jpg_path = add_image(session_factory, dirs, "photo", 10, ext=".jpg", analysis_id="analysis_photo_jpg")
+    with open(jpg_path, "rb") as f:
+        jpg_bytes = f.read()
+
+    stats = make_manager(env, recompress_after_days=7).run_once(NOW)
+
+    assert stats["recompressed"] == 1
+    with open(jpg_path, "rb") as f:
+        assert f.read() == jpg_bytes
+    db = session_factory()
+    paths = {i.filename: i.file_path for i in db.query(Image).all()}
+    assert paths["photo.jpg"] == jpg_path
+    assert paths["photo.png"] != jpg_path
+    assert os.path.exists(paths["photo.png"])
+    db.close()
+
+def test_move_to_cold_with_read_through(env):
+    """Test tiering to the cold store and transparent reads"""
+    session_factory, dirs, store = env
+    old_path = add_image(session_factory, dirs, "old", 10)
+    original = cv2.imread(old_path)
+
+    stats = make_manager(env, cold_after_days=7).run_once(NOW)
+
+    assert stats["moved_to_cold"] == 1
+    assert not os.path.exists(old_path)
+    db = session_factory()
+    image = db.query(Image).first()
+    assert image.file_path == COLD_PREFIX + "old.png"
+    db.close()
+
+    local_path = storage.resolve_path(image.file_path, store=store, cache_dir=str(dirs["cache"]))
+    assert np.array_equal(cv2.imread(local_path), original)
+
+    # Deleting a cold image removes the object and its cached copy
+    make_manager(env, retention_days=1).run_once(NOW)
+    assert not store.exists("old.png")
+    assert not os.path.exists(local_path)
+
+def test_images_with_running_analyses_are_left_alone(env):
+    """Test that no step touches an image an analysis is still reading"""
+    session_factory, dirs, _ = env
+    path = add_image(session_factory, dirs, "busy", 40)
+    db = session_factory()
+    db.query(Analysis).update({"status": "processing"})
+    db.commit()
+    db.close()
+
+    stats = make_manager(
+        env, retention_days=30, recompress_after_days=7, cold_after_days=7, max_storage_mb=0.000001
+    ).run_once(NOW)
+
+    assert stats["expired"] == stats["recompressed"] == stats["moved_to_cold"] == stats["evicted"] == 0
+    assert os.path.exists(path)
+    db = session_factory()
+    assert db.query(Image).first().file_path == path
+    db.close()
+
+def test_background_passes_respect_should_run(env):
+    """Test that shared steps are skipped while should_run is False"""
+    session_factory, dirs, _ = env
+    old_path = add_image(session_factory, dirs, "old", 4000)
+    manager = make_manager(env, retention_days=30)
+    manager.should_run = lambda: False
+    manager.interval = 0.01
+
+    orphan = dirs["cache"] / "deleted.png"
+    orphan.write_bytes(b"x")
+
+    manager.start()
+    time.sleep(0.1)
+    manager.stop()
+
+    assert os.path.exists(old_path)
+    # The local cache is still trimmed on nodes that skip the shared steps
+    assert not orphan.exists()
+
+def test_resolve_path_cleans_up_failed_fetch(env):
+    """Test that a failed cold read leaves no temporary file behind"""
+    _, dirs, store = env
+
+    with pytest.raises(FileNotFoundError):
+        storage.resolve_path(COLD_PREFIX + "missing.png", store=store, cache_dir=str(dirs["cache"]))
+
+    assert os.listdir(dirs["cache"]) == []
+
+def test_resolve_local_path_unchanged():
+    """Test that local paths are returned as-is"""
+    assert storage.resolve_path("uploads/a.jpg") == "uploads/a.jpg"
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", "test_storage.py"])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Script para gerar o modelo ONNX mínimo usado nos testes do ObjectDetector.
+
+O modelo segue o formato de saída do YOLOv5 (1, N, 5 + classes) para uma
+entrada de 64x64. As caixas são fixas e as confianças dependem da cor média
+da imagem: a caixa 0 detecta "fire" proporcionalmente ao canal vermelho e a
+caixa 2 detecta "plant" proporcionalmente ao canal verde. A caixa 1 é uma
+cópia deslocada da caixa 0 com confiança menor, para exercitar o NMS.
+
+Requer o pacote `onnx` (apenas para gerar o arquivo).
+"""
+
+import os
+import sys
+
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+
+INPUT_SIZE = 64
+CLASSES = [
+    "tree", "plant", "water", "building", "vehicle",
+    "person", "animal", "waste", "fire", "smoke"
+]
+FIRE = CLASSES.index("fire")
+PLANT = CLASSES.index("plant")
+
+OUTPUT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "backend", "test_data", "tiny_detector.onnx"
+)
+
+
+def build_model():
+    """Build the tiny detector graph"""
+    num_boxes = 3
+    row = 5 + len(CLASSES)
+
+    # Caixas fixas (cx, cy, w, h) e objectness 1.0
+    bias = np.zeros((num_boxes, row), dtype=np.float32)
+    bias[0, :5] = [16, 16, 16, 16, 1.0]
+    bias[1, :5] = [17, 17, 16, 16, 1.0]
+    bias[2, :5] = [44, 44, 24, 24, 1.0]
+
+    # Pesos das classes a partir da média dos canais RGB
+    weights = np.zeros((3, num_boxes, row), dtype=np.float32)
+    weights[0, 0, 5 + FIRE] = 1.0
+    weights[0, 1, 5 + FIRE] = 0.9
+    weights[1, 2, 5 + PLANT] = 1.0
+
+    initializers = [
+        numpy_helper.from_array(np.array([1, 3], dtype=np.int64), "pooled_shape"),
+        numpy_helper.from_array(weights.reshape(3, -1), "weights"),
+        numpy_helper.from_array(bias.reshape(1, -1), "bias"),
+        numpy_helper.from_array(np.array([1, num_boxes, row], dtype=np.int64), "output_shape"),
+    ]
+    nodes = [
+        helper.make_node("GlobalAveragePool", ["images"], ["pooled"]),
+        helper.make_node("Reshape", ["pooled", "pooled_shape"], ["flat"]),
+        helper.make_node("MatMul", ["flat", "weights"], ["scores"]),
+        helper.make_node("Add", ["scores", "bias"], ["rows"]),
+        helper.make_node("Reshape", ["rows", "output_shape"], ["output0"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "tiny_detector",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, [1, 3, INPUT_SIZE, INPUT_SIZE])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, [1, num_boxes, row])],
+        initializer=initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    return model
+
+
+def main():
+    """Função principal para gerar o modelo de teste."""
+    path = sys.argv[1] if len(sys.argv) > 1 else OUTPUT_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    onnx.save(build_model(), path)
+    print(f"Modelo salvo em {path}")
+
+
+if __name__ == "__main__":
+    main()